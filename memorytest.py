@@ -1,15 +1,45 @@
-from partfinder import main, subset, scheme, config
+import os
+import sys
+import shutil
+import tempfile
 
+from partfinder import main, subset, scheme, config, partition, phyml
+
+from pympler import asizeof
 from pympler.classtracker import ClassTracker
+
+
+def compare_sizes():
+    """The size of one subset and one result, as getsizeof sees them and as
+    they really are. getsizeof leaves out the __dict__ of each object, and
+    everything it refers to"""
+    cfg = config.Configuration()
+    part = partition.Partition(cfg, 'sizes', (1, 300, 3))
+    sub = subset.Subset(part)
+    result = phyml.PhymlResult(-1000.0, 1.5, 2.0)
+    sub.add_result(cfg, 'GTR+G', result)
+    for name, obj in [("Subset", sub), ("PhymlResult", result)]:
+        print "%-12s getsizeof %6d  asizeof %6d" % (
+            name, sys.getsizeof(obj), asizeof.asizeof(obj))
+
+
+compare_sizes()
+
 tracker = ClassTracker()
 # Plug it in here..
 scheme.tracker = tracker
 
-scheme.tracker = tracker
+# The tracker needs weak references, and the other classes have slots
+# without them, so compare_sizes covers the results
 tracker.track_class(subset.Subset)
-tracker.track_class(scheme.Scheme)
 tracker.create_snapshot()
-main.call_main("DNA", "--raxml examples/nucleotide --cmd ' -T 2'" )
-# main.call_main("DNA", "--raxml Li_2008")
+
+# Run on a copy, so we don't touch the analysis of the example
+folder = os.path.join(tempfile.mkdtemp(), "nucleotide")
+shutil.copytree("examples/nucleotide", folder,
+                ignore=shutil.ignore_patterns("analysis", "log.txt"))
+main.call_main("DNA", '"%s"' % folder)
+# main.call_main("DNA", '--raxml "%s" --cmd " -T 2"' % folder)
 tracker.create_snapshot()
 tracker.stats.print_summary()
+shutil.rmtree(os.path.dirname(folder))
@@ -25,6 +25,16 @@ import logging
 log = logging.getLogger("alignment")
 
 import os
+import signal
+from itertools import islice
+import multiprocessing
+from hashlib import md5
+
+# numpy makes handling big alignments much quicker, but we can manage without
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from pyparsing import (
     Word, OneOrMore, alphas, nums, Suppress, Optional, Group, stringEnd,
@@ -139,14 +149,92 @@ class AlignmentParser(object):
 def parse(s):
     return AlignmentParser().parse(s)
 
+def make_matrix(sequences):
+    """Turn a list of equal length strings into a taxa x sites matrix"""
+    if numpy is None:
+        return sequences
+    matrix = numpy.empty((len(sequences), len(sequences[0])), dtype=numpy.uint8)
+    for i, seq in enumerate(sequences):
+        matrix[i] = numpy.frombuffer(seq, dtype=numpy.uint8)
+    return matrix
+
+def get_row(matrix, i):
+    """One species' sequence from a matrix, as a string"""
+    if numpy is None:
+        return matrix[i]
+    return matrix[i].tostring()
+
+def take_columns(matrix, columns):
+    """A new matrix with just these columns, in this order"""
+    if numpy is None:
+        columns = list(columns)
+        return [''.join([seq[i] for i in columns]) for seq in matrix]
+    # One index array for all of the species at once
+    index = numpy.array(columns, dtype=numpy.intp)
+    return matrix.take(index, axis=1)
+
 class Alignment(object):
+    """The sequences, held as a taxa x sites matrix of character codes
+
+    With numpy the matrix is a uint8 array, so pulling out the columns of a
+    subset is a single indexing operation. Without it, we fall back to a list
+    of strings, one per species.
+    """
     def __init__(self):
-        self.species = {}
+        # The species names, in the same order as the rows of the matrix
+        self.names = []
+        self.matrix = None
         self.sequence_len = 0
+        self._species = None
+        # Where the sequences are, if they're memory-mapped
+        self.store_path = None
+        self.store_offset = 0
 
     def __str__(self):
         return "Alignment(%s species, %s codons)" % self.species, self.sequence_len
 
+    @property
+    def species(self):
+        """The sequences as a dict of species name to string"""
+        if self._species is None:
+            self._species = dict(
+                (nm, get_row(self.matrix, i)) for i, nm in enumerate(self.names))
+        return self._species
+
+    def get_block(self, columns):
+        """The sequences for just these columns, as a dict of species name
+        to string
+
+        Unlike species, this only ever reads the columns it needs, so it is
+        the one to use on a memory-mapped alignment.
+        """
+        block = take_columns(self.matrix, columns)
+        return dict(
+            (nm, get_row(block, i)) for i, nm in enumerate(self.names))
+
+    def __getstate__(self):
+        # A mapped alignment is sent to other processes by the name of its
+        # store, which they map for themselves, so the sequences aren't copied
+        state = self.__dict__.copy()
+        state['_species'] = None
+        if self.store_path is not None:
+            state['matrix'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.store_path is not None:
+            self.map_columns(self.store_path)
+
+    def set_sequences(self, names, matrix):
+        self.names = names
+        self.matrix = matrix
+        self._species = None
+        if names:
+            self.sequence_len = len(matrix[0])
+        else:
+            self.sequence_len = 0
+
     def same_as(self, other):
         if self.sequence_len != other.sequence_len:
             log.warning("Alignments not the same, length differs %s: %s", self.sequence_len, other.sequence_len)
@@ -174,7 +262,7 @@ class Alignment(object):
                 raise AlignmentError
 
             # Assign it
-            species[spec] = seq
+            species[spec] = str(seq)
 
             if sequence_len is None:
                 sequence_len = len(seq)
@@ -186,9 +274,11 @@ class Alignment(object):
         log.debug("Found %d species with sequence length %d",
                   len(species), sequence_len)
 
-        # Overwrite these
-        self.species = species
-        self.sequence_len = sequence_len
+        # Keep the species in the order we have always written them out in.
+        # phyml's results depend (a little) on the order, so this keeps them
+        # the same as they were.
+        names = list(species)
+        self.set_sequences(names, make_matrix([species[nm] for nm in names]))
 
     def read(self, pth):
         if not os.path.exists(pth):
@@ -206,18 +296,138 @@ class Alignment(object):
         fd = open(pth, 'w')
         log.debug("Writing phylip file '%s'", pth)
 
-        species_count = len(self.species)
-        sequence_len = len(iter(self.species.itervalues()).next())
-
-        fd.write("%d %d\n" % (species_count, sequence_len))
-        for species, sequence in self.species.iteritems():
+        fd.write("%d %d\n" % (len(self.names), self.sequence_len))
+        for i, species in enumerate(self.names):
             # we use a version of phylip which can have longer species names, up to 100
             shortened = "%s    " %(species[:99])
             fd.write(shortened)
-            fd.write(sequence)
+            fd.write(get_row(self.matrix, i))
+            fd.write("\n")
+        fd.close()
+
+    # How many sites write_subset_phylip takes from the alignment at once
+    CHUNK_SITES = 1 << 16
+
+    def write_subset_phylip(self, pth, columns):
+        """Write the sequences of just these columns, a chunk of sites at a
+        time, so memory use doesn't depend on how long the alignment is
+
+        Each species' line is the same length, so we know where every piece
+        of it goes before we write it.
+        """
+        if numpy is None:
+            # The sequences are all in memory anyway
+            sub = Alignment()
+            sub.set_sequences(list(self.names), take_columns(self.matrix, columns))
+            sub.write(pth)
+            return
+
+        log.debug("Writing phylip file '%s'", pth)
+        length = len(columns)
+        fd = open(pth, 'wb')
+        fd.write("%d %d\n" % (len(self.names), length))
+        starts = []
+        for species in self.names:
+            shortened = "%s    " %(species[:99])
+            fd.write(shortened)
+            starts.append(fd.tell())
+            fd.seek(length, 1)
             fd.write("\n")
+
+        done = 0
+        sites = iter(columns)
+        while done < length:
+            index = numpy.fromiter(
+                islice(sites, self.CHUNK_SITES), dtype=numpy.intp)
+            block = self.take_sites(index)
+            for i, start in enumerate(starts):
+                fd.seek(start + done)
+                fd.write(block[i].tostring())
+            done += len(index)
         fd.close()
 
+    def take_sites(self, index):
+        """The matrix of just these sites, which must be in order
+
+        With a column store, we only map the part of it the sites are in,
+        and let it go again, so the pages we've read don't stay with us.
+        """
+        if self.store_path is None:
+            return self.matrix.take(index, axis=1)
+        lo = index[0]
+        part = numpy.memmap(
+            self.store_path, dtype=numpy.uint8, mode='r',
+            offset=self.store_offset + lo * len(self.names),
+            shape=(index[-1] + 1 - lo, len(self.names)))
+        block = part[index - lo].T
+        del part
+        return block
+
+    def write_columns(self, pth, source_digest):
+        """Store the sequences column by column, so they can be mapped
+
+        The columns go in a numpy file, and the species names (the rows) go
+        in a text file next to it, after the digest of the alignment file the
+        store was made from.
+        """
+        log.debug("Writing column store '%s'", pth)
+        # Fill it in one species at a time, so we never need a second copy
+        # of the whole alignment in memory
+        columns = numpy.lib.format.open_memmap(
+            pth, mode='w+', dtype=numpy.uint8,
+            shape=(self.sequence_len, len(self.names)))
+        for i in range(len(self.names)):
+            columns[:, i] = self.matrix[i]
+        columns.flush()
+        del columns
+        fd = open(get_names_path(pth), 'w')
+        fd.write(source_digest + "\n")
+        for species in self.names:
+            fd.write(species + "\n")
+        fd.close()
+
+    def map_columns(self, pth):
+        """Use a column store instead of holding the sequences in memory
+
+        The matrix becomes a view of the mapped file, so reading the columns
+        of a subset only reads those columns from disk.
+        """
+        log.debug("Mapping column store '%s'", pth)
+        lines = open(get_names_path(pth)).read().splitlines()
+        columns = numpy.load(pth, mmap_mode='r')
+        self.set_sequences(lines[1:], columns.T)
+        self.store_path = pth
+        # Where the sites start in the file
+        self.store_offset = columns.offset
+
+def column_store_available():
+    # We need numpy to map the store
+    return numpy is not None
+
+def get_file_digest(pth):
+    """A digest of a file, read a piece at a time"""
+    d = md5()
+    fd = open(pth, 'rb')
+    while True:
+        chunk = fd.read(1 << 20)
+        if not chunk:
+            break
+        d.update(chunk)
+    fd.close()
+    return d.hexdigest()
+
+def get_names_path(columns_path):
+    return os.path.splitext(columns_path)[0] + '.txt'
+
+def read_store_digest(columns_path):
+    """The digest of the alignment file a column store was made from"""
+    if not column_store_available() or not os.path.exists(columns_path):
+        return None
+    names_path = get_names_path(columns_path)
+    if not os.path.exists(names_path):
+        return None
+    return open(names_path).readline().strip()
+
 class SubsetAlignment(Alignment):
     """Create an alignment based on some others and a subset definition"""
     def __init__(self, source, subset):
@@ -225,22 +435,73 @@ class SubsetAlignment(Alignment):
         Alignment.__init__(self)
 
         #let's do a basic check to make sure that the specified sites aren't > alignment length
-        site_max = max(subset.columns)+1
+        site_max = subset.columns.last()+1
         log.debug("Max site in data_blocks: %d; max site in alignment: %d" %(site_max, source.sequence_len))
         if site_max>source.sequence_len:
             log.error("Site %d is specified in [data_blocks], but the alignment only has %d sites. Please check." %(site_max, source.sequence_len))
             raise AlignmentError
 
-        # Pull out the columns we need
-        for species_name, old_sequence in source.species.iteritems():
-            new_sequence = ''.join([old_sequence[i] for i in subset.columns])
-            self.species[species_name] = new_sequence
-
-        if not self.species:
+        if not source.names:
             log.error("No species found in %s", self)
             raise AlignmentError
 
-        self.sequence_len = len(self.species.itervalues().next())
+        # Pull out the columns we need
+        self.set_sequences(
+            list(source.names),
+            take_columns(source.matrix, subset.columns))
+
+# The source alignment, in a writer process
+_source = None
+
+def _attach_source(source):
+    global _source
+    _source = source
+    # The main process deals with Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _write_subset(columns, pth):
+    sub = Alignment()
+    sub.set_sequences(list(_source.names), take_columns(_source.matrix, columns))
+    sub.write(pth)
+
+class AlignmentWriter(object):
+    """Writes subset alignments, in worker processes if we can
+
+    The workers attach to the source alignment's column store, so they
+    don't get a copy of the sequences. If there is no store, or we only
+    have one process, the alignments are written straight away instead.
+    """
+
+    # Waiting with a timeout means Ctrl-C still works while we wait
+    WAIT_TIMEOUT = 60 * 60 * 24 * 365
+
+    def __init__(self, source, processes):
+        self.source = source
+        self.pool = None
+        self.pending = []
+        if processes > 1 and source.store_path is not None:
+            log.debug("Writing subset alignments with %d processes", processes)
+            self.pool = multiprocessing.Pool(
+                processes, _attach_source, (source,))
+
+    def write_subset(self, subset, pth):
+        if self.pool is None:
+            SubsetAlignment(self.source, subset).write(pth)
+        else:
+            self.pending.append(self.pool.apply_async(
+                _write_subset, (subset.columns, pth)))
+
+    def wait(self):
+        """Wait for all of the alignments to be written"""
+        pending, self.pending = self.pending, []
+        for result in pending:
+            result.get(self.WAIT_TIMEOUT)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
 
 class TestAlignment(Alignment):
     """Good for testing stuff"""
@@ -20,10 +20,15 @@ log = logging.getLogger("analysis")
 
 import os
 import shutil
+from hashlib import md5
 
-from alignment import Alignment, SubsetAlignment
+from alignment import (
+    Alignment, AlignmentError, AlignmentWriter, column_store_available,
+    get_file_digest, read_store_digest)
 import threadpool
 import scheme
+import journal
+import store
 import subset
 import results
 import threading
@@ -40,10 +45,27 @@ class Analysis(object):
         cfg.validate()
         self.cfg = cfg
         self.threads = threads
+        self.alignment_writer = None
 
         self.results = results.AnalysisResults(self.cfg.model_selection)
 
+        # Check this now, rather than after we've made the starting tree
+        self.sweep = cfg.get_sweep()
+
         log.info("Beginning Analysis")
+
+        if force_restart and cfg.incremental:
+            log.error("An incremental analysis needs the previous analysis, "
+                      "so you can't use it with --force-restart")
+            raise AnalysisError
+
+        # Do this first, it might be in the output folder we're deleting
+        self.start_scheme = None
+        if cfg.start_scheme is not None:
+            self.start_scheme = self.load_start_scheme(cfg.start_scheme)
+        elif cfg.incremental:
+            self.start_scheme = self.load_previous_scheme()
+
         self.process_restart(force_restart)
 
         # Check for old analyses to see if we can use the old data
@@ -51,67 +73,433 @@ class Analysis(object):
 
         # Make some folders for the analysis
         self.cfg.make_output_folders()
+        self.cfg.result_store = store.ResultStore(
+            os.path.join(self.cfg.subsets_path, store.STORE_NAME))
         self.make_alignment(cfg.alignment_path)
         self.make_tree(cfg.user_tree_topology_path)
+        self.make_cache_digests()
+        self.cfg.result_store.check_old_names(
+            self.cfg.cache_digest, self.cfg.same_settings)
+
+        # In an incremental analysis, we only look at merging the new blocks
+        self.new_blocks = None
+        if self.cfg.new_blocks is not None:
+            if self.start_scheme is None:
+                log.warning("There is no best scheme from the previous "
+                            "analysis, so we'll search all of the schemes")
+            else:
+                self.new_blocks = set(
+                    [self.cfg.partitions[nm] for nm in self.cfg.new_blocks])
+                if self.new_blocks:
+                    log.info("Found %d new data blocks: %s",
+                             len(self.new_blocks),
+                             ", ".join(sorted(self.cfg.new_blocks)))
+                else:
+                    log.info("There are no new data blocks")
+
+        # A sweep starts a journal for each of its settings
+        if self.sweep is None:
+            self.start_journal()
 
         # We need this to block the threads for critical stuff
         self.lock = threading.Condition(threading.Lock())
 
+        # Only made if we need it
+        self.likelihood_engine = None
+
+    def load_start_scheme(self, name):
+        """Find the scheme to start the search from: one of the user schemes,
+        or the scheme described in a file, like the best_scheme.txt from an
+        earlier analysis
+        """
+        if name in self.cfg.user_schemes.schemes_by_name:
+            sch = self.cfg.user_schemes.schemes_by_name[name]
+            log.info("Starting the search from user scheme '%s'", name)
+        else:
+            pth = name
+            if not os.path.exists(pth):
+                pth = os.path.join(self.cfg.base_path, name)
+            if not os.path.exists(pth):
+                log.error("The start scheme '%s' is not one of the schemes in "
+                          "the .cfg file, or a file", name)
+                raise AnalysisError
+            log.info("Starting the search from the scheme in '%s'", pth)
+            sch = self.read_start_scheme(pth)
+
+        # Recreate it, so that it has a description
+        return scheme.create_scheme(
+            self.cfg, "start_scheme",
+            scheme.get_scheme_description(self.cfg, sch))
+
+    def load_previous_scheme(self):
+        """The best scheme from the previous analysis, if there was one"""
+        pth = os.path.join(self.cfg.output_path, 'best_scheme.txt')
+        if not os.path.exists(pth):
+            return None
+        log.info("Starting the search from the best scheme of the previous "
+                 "analysis, with any new data blocks in their own subsets")
+        sch = self.read_start_scheme(pth)
+        return scheme.create_scheme(
+            self.cfg, "start_scheme",
+            scheme.get_scheme_description(self.cfg, sch))
+
+    def read_start_scheme(self, pth):
+        # Data blocks might have been added or removed since an earlier
+        # analysis, that's fine if we're doing an incremental one
+        try:
+            return scheme.parse_scheme_description(
+                self.cfg, "start_scheme", open(pth).read(),
+                complete=self.cfg.incremental)
+        except scheme.SchemeError:
+            log.error("Couldn't make a start scheme from '%s'", pth)
+            raise AnalysisError
+
+    def get_start_scheme(self):
+        """The scheme that the searches start from, which is every data block
+        in its own subset unless we've been given another one
+        """
+        if self.start_scheme is not None:
+            return self.start_scheme
+        return scheme.create_scheme(
+            self.cfg, "start_scheme", range(len(self.cfg.partitions)))
+
     def process_restart(self, force_restart):
         if force_restart:
             # Remove everything
             if os.path.exists(self.cfg.output_path):
                 log.warning("Deleting all previous workings in '%s'", self.cfg.output_path)
                 shutil.rmtree(self.cfg.output_path)
+
+    def start_journal(self):
+        """If we've run this search before, we can carry on where it got to"""
+        name = 'journal.bin'
+        if self.cfg.sweep_name is not None:
+            name = 'journal_%s.bin' % self.cfg.sweep_name
+        self.journal = journal.SearchJournal(
+            os.path.join(self.cfg.output_path, name),
+            self.get_search_digest())
+        self.resume = self.journal.load()
+        if self.resume is None:
+            # The schemes will be recalculated from existing subset data
+            log.info("Removing Schemes in '%s'", self.cfg.schemes_path)
+            util.clean_out_folder(self.cfg.schemes_path)
         else:
-            # Just remove the schemes folder
-            if os.path.exists(self.cfg.schemes_path):
-                log.info("Removing Schemes in '%s' (they will be recalculated from existing subset data)", self.cfg.schemes_path)
-                shutil.rmtree(self.cfg.schemes_path)
+            log.info("Resuming the search from the journal in '%s'",
+                     self.journal.path)
+
+    def get_search_digest(self):
+        """A digest of everything that could change the path a search takes,
+        so we only resume a search that would have gone the same way"""
+        cfg = self.cfg
+        parts = [cfg.partitions[i] for i in range(len(cfg.partitions))]
+        start_description = None
+        if self.start_scheme is not None:
+            start_description = self.start_scheme.description
+        new_blocks = None
+        if self.new_blocks is not None:
+            new_blocks = sorted([p.name for p in self.new_blocks])
+        search_models = None
+        if cfg.search_models is not None:
+            search_models = sorted(cfg.search_models)
+        settings = [
+            cfg.cache_digest, [(p.name, p.digest) for p in parts],
+            cfg.search, cfg.model_selection, sorted(cfg.models),
+            search_models, cfg.prune_models, cfg.screen_margin,
+            cfg.sample_percent, cfg.sample_promote, cfg.prescreen,
+            sorted(cfg.cluster_weights.items()), cfg.cluster_percent,
+            cfg.cluster_neighbours, cfg.cluster_start_percent,
+            cfg.cluster_max, start_description, new_blocks, cfg.reoptimise,
+        ]
+        return md5(repr(settings)).hexdigest()
+
+    def record_search(self, current, finished=False, **state):
+        """Write the state of the search to the journal"""
+        def describe(sch):
+            if sch is None:
+                return None
+            return sch.name, scheme.get_scheme_description(self.cfg, sch)
+
+        self.journal.record(
+            current=describe(current),
+            best=describe(self.results.best_scheme),
+            all_blocks=self.new_blocks is None,
+            finished=finished, **state)
+
+    def resume_search(self):
+        """Get back to where the journal says the search got to, and return
+        the scheme it was working from"""
+        state = self.resume
+        name, description = state['best']
+        best = scheme.create_scheme(self.cfg, name, description)
+        log.info("The best scheme so far is scheme %s", name)
+        self.analyse_scheme(best)
+
+        current = None
+        if state['current'] is not None:
+            name, description = state['current']
+            current = scheme.create_scheme(self.cfg, name, description)
+            if current.part_subsets == best.part_subsets:
+                current = best
+            else:
+                self.analyse_scheme(current)
+
+        if state['all_blocks']:
+            self.new_blocks = None
+        return current
 
     def analyse(self):
-        self.do_analysis()
+        try:
+            if self.sweep is None:
+                self.analyse_search()
+            else:
+                self.analyse_sweep()
+        finally:
+            if self.alignment_writer is not None:
+                self.alignment_writer.close()
+                self.alignment_writer = None
+            # Write out whatever the last subsets finished with
+            self.cfg.result_store.close()
+
+        subset.recent_subsets.report()
+
+        # The new data blocks are part of the analysis now
+        if self.cfg.incremental:
+            self.cfg.write_old_config()
         return self.results
 
+    def analyse_search(self):
+        if self.cfg.search_models is None:
+            self.do_analysis()
+        else:
+            self.analyse_with_search_models()
+
+    def analyse_sweep(self):
+        """Do the search with each of the settings in the sweep
+
+        They all share the alignment, the starting tree, and the subsets, so
+        anything one of them has analysed is there for the others. They run
+        in turn, not in one pool, as each subset only holds the model
+        selection of one setting at a time.
+        """
+        sweep_results = []
+        for name, settings in self.sweep:
+            self.cfg.use_sweep_settings(name, settings)
+            self.results = results.AnalysisResults(self.cfg.model_selection)
+            self.start_journal()
+            self.analyse_search()
+            sweep_results.append((name, self.results))
+        self.cfg.reporter.write_sweep_summary(sweep_results)
+
+    def involves_new_blocks(self, subsets):
+        """Whether an incremental analysis should look at merging these
+        subsets
+        """
+        if self.new_blocks is None:
+            return True
+        new_mask = 0
+        for p in self.new_blocks:
+            new_mask |= p.mask
+        for sub in subsets:
+            if sub.mask & new_mask:
+                return True
+        return False
+
+    def reoptimise(self):
+        """Once we've found nothing better by merging the new data blocks,
+        see whether we should go on to search everything
+        """
+        if self.new_blocks is None or not self.cfg.reoptimise:
+            return False
+        log.info("Re-optimising the whole scheme")
+        self.new_blocks = None
+        return True
+
+    def analyse_with_search_models(self):
+        """Search using just the search models, then do full model selection
+        on the best scheme we found
+        """
+        all_models = self.cfg.models
+        self.cfg.models = set(self.cfg.search_models)
+        try:
+            self.do_analysis()
+        finally:
+            self.cfg.models = all_models
+
+        best_scheme = self.results.best_scheme
+        log.info("Selecting models for the subsets in the best scheme "
+                 "(scheme %s)", best_scheme.name)
+
+        # The scores from the search aren't comparable with the final ones
+        self.results = results.AnalysisResults(self.cfg.model_selection)
+        res = self.analyse_scheme(best_scheme)
+        self.cfg.reporter.write_scheme_summary(best_scheme, res)
+        self.cfg.reporter.write_best_scheme(self.results)
+
     def make_alignment(self, source_alignment_path):
-        # Make the alignment
+        self.alignment_path = os.path.join(self.cfg.start_tree_path, 'source.phy')
+        columns_path = os.path.join(self.cfg.start_tree_path, 'source_columns.npy')
+        source_digest = get_file_digest(source_alignment_path)
+        # The filtered alignment depends on this too
+        self.source_digest = source_digest
+
+        # If we stored this alignment column by column last time, we don't
+        # need to read it again, just map the store
         self.alignment = Alignment()
+        if os.path.exists(self.alignment_path) and \
+                read_store_digest(columns_path) == source_digest:
+            log.info("Using the stored copy of alignment file '%s'",
+                     source_alignment_path)
+            self.alignment.map_columns(columns_path)
+            return
+
+        # Make the alignment
         self.alignment.read(source_alignment_path)
 
         # We start by copying the alignment
-        self.alignment_path = os.path.join(self.cfg.start_tree_path, 'source.phy')
         if os.path.exists(self.alignment_path):
             # Make sure it is the same
             old_align = Alignment()
             old_align.read(self.alignment_path)
             if not old_align.same_as(self.alignment):
-                log.error("Alignment file has changed since previous run. You need to use the force-restart option.")
-                raise AnalysisError
+                if self.cfg.new_blocks is None:
+                    log.info("The alignment has changed since the previous "
+                             "analysis, so the subsets it affects will be "
+                             "analysed again")
+                else:
+                    self.check_old_blocks(old_align)
+                self.alignment.write(self.alignment_path)
 
         else:
             self.alignment.write(self.alignment_path)
 
-    def need_new_tree(self, tree_path):
+        if column_store_available():
+            # Swap the sequences in memory for the stored ones, so memory use
+            # doesn't depend on how long the alignment is
+            self.alignment.write_columns(columns_path, source_digest)
+            self.alignment.map_columns(columns_path)
+
+    def check_old_blocks(self, old_align):
+        """In an incremental analysis, the alignment can change (usually
+        because we've added some loci), but the data blocks we already had
+        must not. Any that do are treated as new data blocks.
+        """
+        if set(old_align.names) != set(self.alignment.names):
+            log.error("The species in the alignment have changed since the "
+                      "previous analysis, so we can't keep its starting tree. "
+                      "Run the analysis without --incremental instead.")
+            raise AnalysisError
+
+        old_blocks = [p for p in self.cfg.partitions
+                      if p.name not in self.cfg.new_blocks]
+        changed = []
+        for part in old_blocks:
+            if part.columns.last() >= old_align.sequence_len:
+                changed.append(part.name)
+                continue
+            if self.alignment.get_block(part.columns) != \
+                    old_align.get_block(part.columns):
+                changed.append(part.name)
+
+        if changed:
+            log.info("The sites in these data blocks have changed since the "
+                     "previous analysis, so they'll be treated as new data "
+                     "blocks: %s", ", ".join(sorted(changed)))
+            self.cfg.new_blocks.update(changed)
+        else:
+            log.info("The alignment has changed, but the data blocks from "
+                     "the previous analysis haven't")
+
+    def need_new_tree(self, tree_path, tree_digest):
         if os.path.exists(tree_path):
-            if ';' in open(tree_path).read():
-                log.info("Starting tree file found.")
-                redo_tree = False
-            else: 
+            if ';' not in open(tree_path).read():
                 log.info("Starting tree file found but incomplete. Re-estimating")
                 redo_tree = True
+            elif self.cfg.new_blocks is not None:
+                # The stored results for the old data blocks were done on
+                # this tree, so we keep it
+                log.info("Starting tree file found. Keeping it for the "
+                         "incremental analysis.")
+                redo_tree = False
+            elif self.read_tree_digest() is None:
+                # Earlier versions didn't record what the tree was made from,
+                # and the results they stored were done on it
+                log.info("Starting tree file found, from an earlier version. "
+                         "Keeping it.")
+                redo_tree = False
+            elif self.read_tree_digest() != tree_digest:
+                log.info("Starting tree file found, but the data or settings "
+                         "it was made from have changed. Re-estimating")
+                redo_tree = True
+            else:
+                log.info("Starting tree file found.")
+                redo_tree = False
         else:
             log.info("No starting tree file found.")
             redo_tree = True
         
         return redo_tree
 
+    def get_tree_digest(self, user_path):
+        """A digest of everything the starting tree depends on"""
+        d = md5()
+        # A piece at a time, it can be big
+        fd = open(self.filtered_alignment_path, 'rb')
+        while True:
+            chunk = fd.read(1 << 20)
+            if not chunk:
+                break
+            d.update(chunk)
+        fd.close()
+        if user_path is not None and user_path != "":
+            d.update(open(user_path, 'rb').read())
+        d.update(self.cfg.phylogeny_program)
+        d.update(self.cfg.datatype)
+        d.update(self.cfg.processor.get_result_options(
+            self.cfg.cmdline_extras))
+        return d.hexdigest()
+
+    def read_tree_digest(self):
+        pth = os.path.join(self.cfg.start_tree_path, 'tree_digest.txt')
+        if not os.path.exists(pth):
+            return None
+        return open(pth).read().strip()
+
+    def write_tree_digest(self, tree_digest):
+        pth = os.path.join(self.cfg.start_tree_path, 'tree_digest.txt')
+        open(pth, 'w').write(tree_digest + "\n")
+
+    def write_filtered_alignment(self, columns):
+        """Write the alignment of just these columns, unless we already have
+        it from the last analysis
+        """
+        site_max = columns.last() + 1
+        if site_max > self.alignment.sequence_len:
+            log.error("Site %d is specified in [data_blocks], but the "
+                      "alignment only has %d sites. Please check.",
+                      site_max, self.alignment.sequence_len)
+            raise AlignmentError
+
+        # What the filtered alignment was made from
+        key = md5(self.source_digest)
+        key.update(repr(sorted(columns.runs)))
+        key = key.hexdigest()
+        key_path = os.path.join(self.cfg.start_tree_path, 'filtered_source.txt')
+        if os.path.exists(self.filtered_alignment_path) and \
+                os.path.exists(key_path) and \
+                open(key_path).read().strip() == key:
+            log.debug("Using the filtered alignment from the last analysis")
+            return
+
+        self.alignment.write_subset_phylip(
+            self.filtered_alignment_path, columns)
+        open(key_path, 'w').write(key + "\n")
+
     def make_tree(self, user_path):
         # Begin by making a filtered alignment, containing ONLY those columns
         # that are defined in the subsets
         subset_with_everything = subset.Subset(*list(self.cfg.partitions))
-        self.filtered_alignment = SubsetAlignment(self.alignment, subset_with_everything)
         self.filtered_alignment_path = os.path.join(self.cfg.start_tree_path, 'filtered_source.phy')
-        self.filtered_alignment.write(self.filtered_alignment_path)
+        self.write_filtered_alignment(subset_with_everything.columns)
 
         # Now we've written this alignment, we need to lock everything in
         # place, no more adding partitions, or changing them from now on.
@@ -123,12 +511,15 @@ class Analysis(object):
 
         # Now check for the tree
         tree_path = self.cfg.processor.make_tree_path(self.filtered_alignment_path)
+        tree_digest = self.get_tree_digest(user_path)
 
-        if self.need_new_tree(tree_path) == True:
+        if self.need_new_tree(tree_path, tree_digest) == True:
             log.debug("Estimating new starting tree, no old tree found")
             
             # If we have a user tree, then use that, otherwise, create a topology
-            util.clean_out_folder(self.cfg.start_tree_path, keep = ["filtered_source.phy", "source.phy"])
+            util.clean_out_folder(self.cfg.start_tree_path, keep = [
+                "filtered_source.phy", "filtered_source.txt", "source.phy",
+                "source_columns.npy", "source_columns.txt"])
             
             if user_path is not None and user_path != "":
                 # Copy it into the start tree folder
@@ -147,34 +538,79 @@ class Analysis(object):
                 topology_path,
                 self.cfg.datatype,
                 self.cfg.cmdline_extras)
+            self.write_tree_digest(tree_digest)
+        elif self.read_tree_digest() is None:
+            if self.cfg.new_blocks is None:
+                self.write_tree_digest(tree_digest)
+            else:
+                # The tree doesn't have the new blocks, so it mustn't look
+                # like it does once the incremental analysis is over
+                self.write_tree_digest("")
 
         self.tree_path = tree_path
         log.info("Starting tree with branch lengths is here: %s", self.tree_path)
 
-    def run_task(self, m, sub):
+    def make_cache_digests(self):
+        """The subsets are stored under a digest of their sites and of the
+        settings their results depend on, so that we only re-use results
+        that are still good, whatever has changed since they were stored
+        """
+        self.cfg.partitions.make_digests(self.alignment)
+
+        d = md5()
+        d.update(self.cfg.phylogeny_program)
+        d.update(self.cfg.datatype)
+        d.update(self.cfg.branchlengths)
+        d.update(self.cfg.processor.get_result_options(
+            self.cfg.cmdline_extras))
+        # This covers everything the tree was made from too
+        d.update(open(self.tree_path, 'rb').read())
+        self.cfg.cache_digest = d.hexdigest()
+
+    def run_task(self, m, sub, screen=False):
+        # The results of the other models may mean we don't need this one
+        if not screen:
+            self.lock.acquire()
+            try:
+                if sub.prune_model(self.cfg, m):
+                    sub.finalise(self.cfg)
+                    return
+            finally:
+                self.lock.release()
+
         # This bit should run in parallel (forking the processor)
         self.cfg.processor.analyse(
             m,
             sub.alignment_path,
             self.tree_path,
             self.cfg.branchlengths,
-            self.cfg.cmdline_extras
+            self.cfg.cmdline_extras,
+            screen
         )
 
         # Not entirely sure that WE NEED to block here, but it is safer to do
         # It shouldn't hold things up toooo long...
         self.lock.acquire()
         try:
-            sub.parse_model_result(self.cfg, m)
+            sub.parse_model_result(self.cfg, m, screen)
             # Try finalising, then the result will get written out earlier...
-            sub.finalise(self.cfg)
+            if not screen:
+                sub.finalise(self.cfg)
         finally:
             self.lock.release()
 
     def add_tasks_for_sub(self, tasks, sub):
+        for m in sub.models_to_screen:
+            tasks.append((self.run_task, (m, sub, True)))
         for m in sub.models_to_process:
             tasks.append((self.run_task, (m, sub)))
 
+    def run_tasks(self, tasks):
+        if self.threads == 1:
+            self.run_concurrent(tasks)
+        else:
+            self.run_threaded(tasks)
+
     def run_concurrent(self, tasks):
         for func, args in tasks:
             func(*args)
@@ -185,33 +621,143 @@ class Analysis(object):
         pool = threadpool.Pool(tasks, self.threads)
         pool.join()
 
-    def analyse_scheme(self, sch):
-        # Progress
-        self.cfg.progress.next_scheme()
-
+    def get_alignment_writer(self):
+        if self.alignment_writer is None:
+            if self.threads == 1:
+                processes = 1
+            elif self.threads > 1:
+                processes = self.threads
+            else:
+                processes = threadpool.get_cpu_count()
+            self.alignment_writer = AlignmentWriter(self.alignment, processes)
+        return self.alignment_writer
+
+    def prepare_subsets(self, subsets):
+        writer = self.get_alignment_writer()
+        result_store = self.cfg.result_store
+        result_store.load_many([sub.get_cache_name(self.cfg) for sub in subsets
+                                if sub.needs_results(self.cfg)])
+        for sub in subsets:
+            sub.prepare(self.cfg, writer)
+        result_store.forget()
+        # The subset alignments need to be there before we run anything
+        writer.wait()
+
+    def analyse_subsets(self, subsets):
         # Prepare by reading everything in first
+        self.prepare_subsets(subsets)
         tasks = []
-        for sub in sch:
-            sub.prepare(self.cfg, self.alignment)
+        for sub in subsets:
             self.add_tasks_for_sub(tasks, sub)
 
         # Now do the analysis
-        if self.threads == 1:
-            self.run_concurrent(tasks)
-        else:
-            self.run_threaded(tasks)
+        self.run_tasks(tasks)
+
+        if self.cfg.screen_margin is not None:
+            # The screening is done, so now we can run the models that made
+            # the cut
+            self.prepare_subsets(subsets)
+            tasks = []
+            for sub in subsets:
+                self.add_tasks_for_sub(tasks, sub)
+            self.run_tasks(tasks)
 
         # Now see if we're done
-        for sub in sch:
+        for sub in subsets:
             # ALL subsets should already be finalised in the task. We just
             # check again here
             if not sub.finalise(self.cfg):
-                log.error("Failed to run models %s; not sure why", ", ".join(list(sub.models_to_do)))
+                log.error("Failed to run models %s; not sure why", ", ".join(list(sub.models_not_done)))
                 raise AnalysisError
 
+        # Write the results of everything that finished in one go
+        self.cfg.result_store.flush()
+
+    def analyse_scheme(self, sch):
+        # Progress
+        self.cfg.progress.next_scheme()
+
+        self.analyse_subsets(sch)
+
         # AIC needs the number of sequences
-        number_of_seq = len(self.alignment.species)
+        number_of_seq = len(self.alignment.names)
         result = scheme.SchemeResult(sch, number_of_seq, self.cfg.branchlengths, self.cfg.model_selection)
         self.results.add_scheme_result(sch, result)
 
         return result
+
+    def get_likelihood_engine(self):
+        if self.likelihood_engine is None:
+            # This needs numpy, so we don't import it unless we have to
+            import likelihood
+            self.likelihood_engine = likelihood.LikelihoodEngine(
+                self.alignment, self.tree_path, self.cfg.datatype)
+        return self.likelihood_engine
+
+    def prescreen_schemes(self, start_scheme, schemes):
+        """Rank the schemes with a quick likelihood calculation, and return
+        the best few
+
+        Like screen_schemes, each scheme should be the start_scheme with some
+        subsets merged.
+        """
+        keep = self.cfg.prescreen
+        if keep is None or len(schemes) <= keep:
+            return schemes
+
+        engine = self.get_likelihood_engine()
+        meth = self.cfg.model_selection.lower()
+        deltas = []
+        for i, sch in enumerate(schemes):
+            delta = \
+                sum([engine.get_score(s, meth)
+                     for s in sch.subsets - start_scheme.subsets]) - \
+                sum([engine.get_score(s, meth)
+                     for s in start_scheme.subsets - sch.subsets])
+            deltas.append((delta, i))
+        deltas.sort()
+
+        log.info("Prescreened %d schemes, keeping the best %d",
+                 len(schemes), keep)
+        return [schemes[i] for delta, i in deltas[:keep]]
+
+    def screen_schemes(self, start_scheme, schemes):
+        """Pick out the most promising schemes, using a sample of the sites
+
+        Each of the schemes should be the start_scheme with some subsets
+        merged. We score each merge on samples of the subsets, and return just
+        the best few schemes, so that only those get analysed on all the sites.
+        """
+        percent = self.cfg.sample_percent
+        promote = self.cfg.sample_promote
+        if percent is None or len(schemes) <= promote:
+            return schemes
+
+        log.info("Screening %d schemes using %.1f percent of the sites",
+                 len(schemes), percent)
+
+        changes = []
+        samples = set()
+        for sch in schemes:
+            new_subs = [subset.SubsetSample(percent, *s.partitions)
+                        for s in sch.subsets - start_scheme.subsets]
+            old_subs = [subset.SubsetSample(percent, *s.partitions)
+                        for s in start_scheme.subsets - sch.subsets]
+            changes.append((new_subs, old_subs))
+            samples.update(new_subs)
+            samples.update(old_subs)
+
+        self.analyse_subsets(samples)
+
+        # How much does each merge change the score of the samples?
+        deltas = []
+        for i, (new_subs, old_subs) in enumerate(changes):
+            delta = sum([s.best_info_score for s in new_subs]) - \
+                sum([s.best_info_score for s in old_subs])
+            deltas.append((delta, i))
+        deltas.sort()
+
+        promoted = [schemes[i] for delta, i in deltas[:promote]]
+        log.info("Analysing the best %d schemes using all the sites",
+                 len(promoted))
+        return promoted
@@ -20,13 +20,12 @@ import logging
 log = logging.getLogger("method")
 
 import os
-import math
+import itertools
 import scheme
 import algorithm
 import submodels
 import subset
 from analysis import Analysis, AnalysisError
-import neighbour
 
 class UserAnalysis(Analysis):
 
@@ -61,28 +60,37 @@ class StrictClusteringAnalysis(Analysis):
     """
 
     def do_analysis(self):
+        # This needs numpy, which we don't otherwise need
+        import neighbour
+
         log.info("Performing strict clustering analysis")
 
-        partnum = len(self.cfg.partitions)
+        # Start with the most partitioned scheme, unless we were given one
+        start_scheme = self.get_start_scheme()
+
+        partnum = len(start_scheme.subsets)
         subset_count = 2 * partnum - 1
         scheme_count = partnum
         self.cfg.progress.begin(scheme_count, subset_count)
 
-        # Start with the most partitioned scheme
-        start_description = range(len(self.cfg.partitions))
-        start_scheme = scheme.create_scheme(
-            self.cfg, "start_scheme", start_description)
-
-        # Analyse our first scheme
-        log.info("Analysing starting scheme (scheme %s)" % start_scheme.name)
-        self.analyse_scheme(start_scheme)
-
         # Current scheme number
         cur_s = 2
 
+        if self.resume is None:
+            # Analyse our first scheme
+            log.info("Analysing starting scheme (scheme %s)" % start_scheme.name)
+            self.analyse_scheme(start_scheme)
+            self.record_search(start_scheme, cur_s=cur_s)
+        else:
+            start_scheme = self.resume_search()
+            cur_s = self.resume['cur_s']
+
+        # We keep this between steps, so we only calculate what changes
+        matrix = neighbour.make_distance_index(self.cfg)
+
         # Now we try out all clusterings of the first scheme, to see if we can
         # find a better one
-        while True:
+        while len(start_scheme.subsets) > 1:
             log.info("***Strict clustering algorithm step %d of %d***" %
                      (cur_s - 1, partnum - 1))
 
@@ -91,17 +99,15 @@ class StrictClusteringAnalysis(Analysis):
             # Could combine average site-rates, q matrices, and frequencies
             scheme_name = "step_%d" % (cur_s - 1)
             clustered_scheme = neighbour.get_nearest_neighbour_scheme(
-                start_scheme, scheme_name, self.cfg)
+                start_scheme, scheme_name, self.cfg, matrix)
 
             # Now analyse that new scheme
             cur_s += 1
             self.analyse_scheme(clustered_scheme)
 
-            # Stop when we've anlaysed the scheme with all subsets combined
-            if len(set(clustered_scheme.subsets)) == 1:  # then it's the scheme with everything together
-                break
-            else:
-                start_scheme = clustered_scheme
+            # We stop when we've analysed the scheme with all subsets combined
+            start_scheme = clustered_scheme
+            self.record_search(start_scheme, cur_s=cur_s)
 
         self.cfg.progress.end()
 
@@ -110,6 +116,9 @@ class StrictClusteringAnalysis(Analysis):
 
 class AllAnalysis(Analysis):
 
+    # How often we write to the journal, in schemes
+    JOURNAL_INTERVAL = 100
+
     def do_analysis(self):
         log.info("Performing complete analysis")
         partnum = len(self.cfg.partitions)
@@ -122,14 +131,29 @@ class AllAnalysis(Analysis):
         model_iterator = submodels.submodel_iterator([], 1, partnum)
 
         scheme_name = 1
+        if self.resume is not None:
+            # Skip the schemes we've done
+            self.resume_search()
+            scheme_name = self.resume['scheme_name']
+            model_iterator = itertools.islice(
+                model_iterator, scheme_name - 1, None)
+
         for m in model_iterator:
             s = scheme.model_to_scheme(m, scheme_name, self.cfg)
             scheme_name = scheme_name + 1
+            old_best_score = self.results.best_score
             res = self.analyse_scheme(s)
 
             # Write out the scheme
             self.cfg.reporter.write_scheme_summary(s, res)
 
+            # We don't need to record every scheme
+            if self.results.best_score != old_best_score or \
+                    scheme_name % self.JOURNAL_INTERVAL == 0:
+                self.record_search(None, scheme_name=scheme_name)
+
+        self.record_search(None, scheme_name=scheme_name)
+
         self.cfg.reporter.write_best_scheme(self.results)
 
 
@@ -139,26 +163,34 @@ class GreedyAnalysis(Analysis):
 
         log.info("Performing greedy analysis")
 
-        partnum = len(self.cfg.partitions)
+        # Start with the most partitioned scheme, unless we were given one
+        start_scheme = self.get_start_scheme()
+        start_description = start_scheme.description
+
+        partnum = len(start_scheme.subsets)
         scheme_count = submodels.count_greedy_schemes(partnum)
         subset_count = submodels.count_greedy_subsets(partnum)
 
         self.cfg.progress.begin(scheme_count, subset_count)
 
-        # Start with the most partitioned scheme
-        start_description = range(len(self.cfg.partitions))
-        start_scheme = scheme.create_scheme(
-            self.cfg, "start_scheme", start_description)
-
-        log.info("Analysing starting scheme (scheme %s)" % start_scheme.name)
-        self.analyse_scheme(start_scheme)
-
         step = 1
         cur_s = 2
+        finished = False
+
+        if self.resume is None:
+            log.info("Analysing starting scheme (scheme %s)" % start_scheme.name)
+            self.analyse_scheme(start_scheme)
+            self.record_search(start_scheme, step=step, cur_s=cur_s)
+        else:
+            start_scheme = self.resume_search()
+            start_description = start_scheme.description
+            step = self.resume['step']
+            cur_s = self.resume['cur_s']
+            finished = self.resume['finished']
 
         # Now we try out all lumpings of the current scheme, to see if we can
         # find a better one and if we do, we just keep going
-        while True:
+        while not finished:
             log.info("***Greedy algorithm step %d***" % step)
 
             # Get a list of all possible lumpings of the best_scheme
@@ -166,9 +198,22 @@ class GreedyAnalysis(Analysis):
 
             # Save the current best score we have in results
             old_best_score = self.results.best_score
+            lumped_schemes = []
             for lumped_description in lumpings:
                 lumped_scheme = scheme.create_scheme(self.cfg, cur_s, lumped_description)
                 cur_s += 1
+                # In an incremental analysis, we only merge the new blocks
+                if self.involves_new_blocks(
+                        lumped_scheme.subsets - self.results.best_scheme.subsets):
+                    lumped_schemes.append(lumped_scheme)
+
+            # Maybe we only need to look at a few of them properly
+            lumped_schemes = self.prescreen_schemes(
+                self.results.best_scheme, lumped_schemes)
+            lumped_schemes = self.screen_schemes(
+                self.results.best_scheme, lumped_schemes)
+
+            for lumped_scheme in lumped_schemes:
                 # This is just checking to see if a scheme is any good, if it
                 # is, we remember and write it later
                 self.analyse_scheme(lumped_scheme)
@@ -176,7 +221,10 @@ class GreedyAnalysis(Analysis):
             # Did out best score change (It ONLY gets better -- see in
             # results.py)
             if self.results.best_score == old_best_score:
-                # It didn't, so we're done
+                # It didn't, so we're done, unless we only looked at some of
+                # the lumpings
+                if self.reoptimise():
+                    continue
                 break
 
             # Let's look further. We use the description from our best scheme
@@ -195,6 +243,11 @@ class GreedyAnalysis(Analysis):
 
             # Go do the next round...
             step += 1
+            self.record_search(
+                self.results.best_scheme, step=step, cur_s=cur_s)
+
+        self.record_search(
+            self.results.best_scheme, step=step, cur_s=cur_s, finished=True)
 
         log.info("Greedy algorithm finished after %d steps" % step)
         log.info("Highest scoring scheme is scheme %s, with %s score of %.3f" %
@@ -212,68 +265,71 @@ class RelaxedClusteringAnalysis(Analysis):
     2. Analyse cluster-percent of the most similar schemes
     3. Take the scheme that improves the AIC/BIC score the most
     4. Quit if no improvements.
+
+    With rcluster-start-percent, step 2 starts with a smaller share of the
+    schemes, and only widens it (doubling it each time, up to cluster-percent)
+    if none of the schemes it looked at improve the score. With rcluster-max,
+    step 2 never looks at more than that many schemes.
     '''
 
     def do_analysis(self):
-        log.info("Performing relaxed clustering analysis")
+        # This needs numpy, which we don't otherwise need
+        import neighbour
 
-        stop_at = self.cfg.cluster_percent * 0.01
+        log.info("Performing relaxed clustering analysis")
 
         model_selection = self.cfg.model_selection
-        partnum = len(self.cfg.partitions)
 
-        scheme_count = submodels.count_relaxed_clustering_schemes(partnum, self.cfg.cluster_percent)
-        subset_count = submodels.count_relaxed_clustering_subsets(partnum, self.cfg.cluster_percent)
+        # Start with the most partitioned scheme, unless we were given one
+        start_scheme = self.get_start_scheme()
+        partnum = len(start_scheme.subsets)
 
-        self.cfg.progress.begin(scheme_count, subset_count)
+        start_percent = self.cfg.cluster_start_percent
+        if start_percent is None:
+            start_percent = self.cfg.cluster_percent
 
-        # Start with the most partitioned scheme, and record it.
-        start_description = range(len(self.cfg.partitions))
-        start_scheme = scheme.create_scheme(
-            self.cfg, "start_scheme", start_description)
-        log.info("Analysing starting scheme (scheme %s)" % start_scheme.name)
-        self.analyse_scheme(start_scheme)
-        self.cfg.reporter.write_scheme_summary(
-            self.results.best_scheme, self.results.best_result)
+        # Any step might widen all the way, so we count them at the full
+        # percent. If every step finds a better scheme we finish early
+        scheme_count = submodels.count_relaxed_clustering_schemes(
+            partnum, self.cfg.cluster_percent,
+            max_schemes=self.cfg.cluster_max)
+        subset_count = submodels.count_relaxed_clustering_subsets(
+            partnum, self.cfg.cluster_percent,
+            max_schemes=self.cfg.cluster_max)
 
+        self.cfg.progress.begin(scheme_count, subset_count)
 
-        # Start by remembering that we analysed the starting scheme
-        subset_counter = 1
         step = 1
-        while True:
+        finished = False
 
-            log.info("***Relaxed clustering algorithm step %d of %d***" % (step, partnum - 1))
-            name_prefix = "step_%d" % (step)
-
-            # Get a list of all possible lumpings of the best_scheme, ordered
-            # according to the clustering weights
-            lumped_subsets = neighbour.get_ranked_clustered_subsets(
-                start_scheme, self.cfg)
-
-            # reduce the size of the lumped subsets to cluster_percent long
-            cutoff = int(math.ceil(len(lumped_subsets)*stop_at)) #round up to stop zeros
-            lumped_subsets = lumped_subsets[:cutoff]
-
-            # Now analyse the lumped schemes
-            lumpings_done = 0
-            old_best_score = self.results.best_score
-
-            for subset_grouping in lumped_subsets:
-                scheme_name = "%s_%d" % (name_prefix, lumpings_done + 1)
-                lumped_scheme = neighbour.make_clustered_scheme(
-                    start_scheme, scheme_name, subset_grouping, self.cfg)
+        if self.resume is None:
+            # Record the starting scheme
+            log.info("Analysing starting scheme (scheme %s)" % start_scheme.name)
+            self.analyse_scheme(start_scheme)
+            self.cfg.reporter.write_scheme_summary(
+                self.results.best_scheme, self.results.best_result)
+            self.record_search(start_scheme, step=step)
+        else:
+            start_scheme = self.resume_search()
+            step = self.resume['step']
+            finished = self.resume['finished']
 
-                new_result = self.analyse_scheme(lumped_scheme)
+        # We keep this between steps, so we only calculate what changes
+        matrix = neighbour.make_distance_index(self.cfg)
 
-                log.debug("Difference in %s: %.1f", self.cfg.model_selection, (new_result.score-old_best_score))
+        while not finished:
 
-                lumpings_done += 1
+            log.info("***Relaxed clustering algorithm step %d of %d***" % (step, partnum - 1))
+            name_prefix = "step_%d" % (step)
 
+            old_best_score = self.results.best_score
+            percent = self.analyse_step(
+                start_scheme, matrix, name_prefix, start_percent)
 
             if self.results.best_score != old_best_score:
                 log.info("Analysed %.1f percent of the schemes for this step. The best "
                          "scheme changed the %s score by %.1f units.",
-                         self.cfg.cluster_percent, self.cfg.model_selection,
+                         percent, self.cfg.model_selection,
                          (self.results.best_score - old_best_score))
 
                 #write out the best scheme
@@ -285,17 +341,21 @@ class RelaxedClusteringAnalysis(Analysis):
                 # Now we find out which is the best lumping we know of for this step
                 start_scheme = self.results.best_scheme
             else:
+                # Maybe we only looked at the lumpings with new blocks
+                if self.reoptimise():
+                    continue
                 log.info("Analysed %.1f percent of the schemes for this step and found no schemes "
-                         "that improve the score, stopping" , self.cfg.cluster_percent)
+                         "that improve the score, stopping" , percent)
                 break
 
             # We're done if it's the scheme with everything together
-            if len(set(lumped_scheme.subsets)) == 1:
+            if len(set(start_scheme.subsets)) == 1:
                 break
 
             step += 1
+            self.record_search(start_scheme, step=step)
 
-
+        self.record_search(start_scheme, step=step, finished=True)
 
         log.info("Relaxed clustering algorithm finished after %d steps" % step)
         log.info("Best scoring scheme is scheme %s, with %s score of %.3f"
@@ -303,6 +363,75 @@ class RelaxedClusteringAnalysis(Analysis):
 
         self.cfg.reporter.write_best_scheme(self.results)
 
+    def analyse_step(self, start_scheme, matrix, name_prefix, start_percent):
+        """Analyse the closest start_percent of the lumpings of the start
+        scheme, widening the search until one of them improves the score (or
+        we reach cluster-percent or cluster-max). Returns the percent we got
+        to.
+        """
+        # This needs numpy, which we don't otherwise need
+        import neighbour
+
+        # In an incremental analysis, we only merge the new blocks, so the
+        # percent is of the lumpings that include them
+        involves = None
+        if self.new_blocks is not None:
+            involves = lambda sub: self.involves_new_blocks([sub])
+
+        old_best_score = self.results.best_score
+        percent = start_percent
+        lumpings_done = 0
+        while True:
+            # Get the closest percent of the possible lumpings of the
+            # best_scheme according to the clustering weights
+            lumped_subsets = neighbour.get_ranked_clustered_subsets(
+                start_scheme, self.cfg, matrix, percent,
+                self.cfg.cluster_max, involves)
+
+            # We've already done the closest ones if we've widened
+            self.analyse_lumpings(
+                start_scheme, lumped_subsets[lumpings_done:],
+                name_prefix, lumpings_done)
+            lumpings_done = len(lumped_subsets)
+
+            if self.results.best_score != old_best_score:
+                break
+            if percent >= self.cfg.cluster_percent:
+                break
+            if self.cfg.cluster_max is not None and \
+                    lumpings_done >= self.cfg.cluster_max:
+                break
+
+            percent = min(percent * 2.0, self.cfg.cluster_percent)
+            log.info("No schemes in this step improved the score, "
+                     "widening the search to %.1f percent of them",
+                     percent)
+
+        return percent
+
+    def analyse_lumpings(self, start_scheme, lumped_subsets, name_prefix,
+                         first):
+        # This needs numpy, which we don't otherwise need
+        import neighbour
+
+        lumped_schemes = []
+        for i, subset_grouping in enumerate(lumped_subsets):
+            scheme_name = "%s_%d" % (name_prefix, first + i + 1)
+            lumped_scheme = neighbour.make_clustered_scheme(
+                start_scheme, scheme_name, subset_grouping, self.cfg)
+            lumped_schemes.append(lumped_scheme)
+
+        # Maybe we only need to look at a few of them properly
+        lumped_schemes = self.prescreen_schemes(
+            start_scheme, lumped_schemes)
+        lumped_schemes = self.screen_schemes(start_scheme, lumped_schemes)
+
+        old_best_score = self.results.best_score
+        for lumped_scheme in lumped_schemes:
+            new_result = self.analyse_scheme(lumped_scheme)
+
+            log.debug("Difference in %s: %.1f", self.cfg.model_selection, (new_result.score-old_best_score))
+
 
 def choose_method(search):
     if search == 'all':
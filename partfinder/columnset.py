@@ -0,0 +1,165 @@
+#Copyright (C) 2012 Robert Lanfear and Brett Calcott
+#
+#This program is free software: you can redistribute it and/or modify it
+#under the terms of the GNU General Public License as published by the
+#Free Software Foundation, either version 3 of the License, or (at your
+#option) any later version.
+#
+#This program is distributed in the hope that it will be useful, but
+#WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#General Public License for more details. You should have received a copy
+#of the GNU General Public License along with this program.  If not, see
+#<http://www.gnu.org/licenses/>. PartitionFinder also includes the PhyML
+#program, the RAxML program, the PyParsing library, and the python-cluster library
+#all of which are protected by their own licenses and conditions, using
+#PartitionFinder implies that you agree with those licences and conditions as well.
+
+"""Sets of alignment columns, held as runs rather than one by one
+
+Data blocks are nearly always a few runs like 1-700\\3, so we keep the runs
+(zero based start, exclusive stop, step) and never make a list of every
+column unless something asks for one.
+"""
+
+import heapq
+from itertools import chain
+
+# We can manage without numpy, but it makes index arrays much quicker
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_run(start, stop, step):
+    """A run with its stop just after its last column, or None if empty"""
+    if stop <= start:
+        return None
+    count = (stop - start - 1) // step + 1
+    return start, start + (count - 1) * step + 1, step
+
+
+def run_length(run):
+    start, stop, step = run
+    return (stop - start - 1) // step + 1
+
+
+class ColumnSet(object):
+    """An immutable set of zero based column numbers
+
+    Iterating gives the columns in order. Unions are only ever made of sets
+    that don't overlap (partitions never do), so a union is just all of the
+    runs together.
+    """
+    def __init__(self, runs=()):
+        self.runs = tuple(runs)
+        self.size = sum([run_length(r) for r in self.runs])
+
+        # If the runs follow one another, we can just read them in turn.
+        # Otherwise (e.g. codon positions) they need merging.
+        self.ordered = True
+        last = -1
+        for start, stop, step in sorted(self.runs):
+            if start <= last:
+                self.ordered = False
+                break
+            last = stop - 1
+        if self.ordered:
+            self.runs = tuple(sorted(self.runs))
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Make one from (start, stop, step) tuples, like range takes"""
+        runs = [make_run(*r) for r in ranges]
+        return cls([r for r in runs if r is not None])
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Make one from any collection of columns"""
+        columns = sorted(columns)
+        runs = []
+        i = 0
+        while i < len(columns):
+            start = columns[i]
+            if i + 1 == len(columns):
+                runs.append((start, start + 1, 1))
+                break
+            step = columns[i + 1] - start
+            j = i + 1
+            while j + 1 < len(columns) and columns[j + 1] - columns[j] == step:
+                j += 1
+            runs.append((start, columns[j] + 1, step))
+            i = j + 1
+        return cls(runs)
+
+    def union(self, *others):
+        runs = list(self.runs)
+        for other in others:
+            runs.extend(other.runs)
+        return ColumnSet(runs)
+
+    __or__ = union
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        return self.size > 0
+
+    def __iter__(self):
+        ranges = [xrange(*r) for r in self.runs]
+        if self.ordered:
+            return chain(*ranges)
+        return heapq.merge(*ranges)
+
+    def __contains__(self, col):
+        for start, stop, step in self.runs:
+            if start <= col < stop and (col - start) % step == 0:
+                return True
+        return False
+
+    def __array__(self, dtype=None):
+        """The columns in order, so numpy can use a ColumnSet as an index"""
+        if not self.runs:
+            index = numpy.zeros(0, dtype=numpy.intp)
+        else:
+            index = numpy.concatenate(
+                [numpy.arange(*r, dtype=numpy.intp) for r in self.runs])
+            if not self.ordered:
+                index.sort()
+        if dtype is not None:
+            index = index.astype(dtype)
+        return index
+
+    def first(self):
+        return min([r[0] for r in self.runs])
+
+    def last(self):
+        return max([r[1] for r in self.runs]) - 1
+
+    def overlaps(self, other):
+        # Quick check of the ranges they cover, before looking closer
+        if not self or not other:
+            return False
+        if self.last() < other.first() or other.last() < self.first():
+            return False
+        small, big = sorted([self, other], key=len)
+        for col in small:
+            if col in big:
+                return True
+        return False
+
+    def missing(self, length):
+        """The columns in range(length) that aren't in this set"""
+        present = bytearray(length)
+        for start, stop, step in self.runs:
+            stop = min(stop, length)
+            if start < stop:
+                present[start:stop:step] = '\x01' * len(xrange(start, stop, step))
+        return [i for i in xrange(length) if not present[i]]
+
+    def __repr__(self):
+        return "ColumnSet(%s)" % ", ".join(
+            ["%s-%s\\%s" % (start + 1, stop, step)
+             for start, stop, step in self.runs])
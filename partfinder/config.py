@@ -28,12 +28,21 @@ import parser
 import util
 import progress
 import numbers
-import errno
 
 class ConfigurationError(util.PartitionFinderError):
     pass
 
 
+def get_sweep_label(option, value):
+    if option == 'model_selection':
+        return value
+    if option == 'cluster_percent':
+        return "percent%g" % value
+    # The weights
+    return "weights%s" % "_".join(["%g" % value[k] for k in
+                                   ("rate", "freqs", "model", "alpha")])
+
+
 class Configuration(object):
     """This holds the user configuration info"""
 
@@ -46,7 +55,13 @@ class Configuration(object):
 
     def __init__(self, datatype="DNA", phylogeny_program='phyml',
         save_phylofiles=False, cmdline_extras = "", cluster_weights = None,
-        cluster_percent=10):
+        cluster_percent=10, prune_models=False, screen_margin=None,
+        search_models=None, sample_percent=None, sample_promote=5,
+        prescreen=None, cluster_neighbours=None, cluster_start_percent=None,
+        cluster_max=None, start_scheme=None, incremental=False,
+        reoptimise=False, sweep_model_selection=None,
+        sweep_cluster_percent=None, sweep_cluster_weights=None,
+        subset_cache=None):
 
         log.info("------------- Configuring Parameters -------------")
         self.partitions = partition.PartitionSet()
@@ -57,6 +72,7 @@ class Configuration(object):
         self.progress = progress.NoProgress(self)
         self.cmdline_extras = cmdline_extras
         self.cluster_percent = float(cluster_percent)
+        self.prune_models = prune_models
 
         # Record this
         self.base_path = '.'
@@ -91,40 +107,7 @@ class Configuration(object):
             self.cluster_weights = {"rate": 1, "freqs": 0,
                                     "model": 0, "alpha": 0}
         else:
-            # TODO. Is there a more robust way to do this...
-            # Brett say "YES. But this will do for now..."
-            cluster_weights = [x.strip() for x in cluster_weights.split(",")]
-
-            #now we check that it's a list of exactly four numbers
-            if len(cluster_weights) != 4:
-                log.error("Your --cluster_weights argument should have exactly 4"
-                          " numbers separated by commas, but it has %d ('%s') "
-                          "Please check and try again", len(cluster_weights), cluster_weights)
-                raise ConfigurationError
-
-            for thing in cluster_weights:
-                try:
-                    num = float(eval(thing))
-                    assert num >= 0
-                except:
-                    log.error("Unable to understand your --cluster_weights argument."
-                              " It should look like this: --cluster_weights '1,2,3,6'. "
-                              "Please double check that you included quotes, "
-                              "and four numbers greater than or equal to zero "
-                              "separated by commas. Then try again. "
-                              "The part that I couldn't understand is this: '%s'" % thing)
-                    raise ConfigurationError
-
-            log.info("Setting cluster_weights to: "
-                     "subset_rate = %s, freqs = %s, model = %s, alpha %s" 
-                     % (cluster_weights[0], cluster_weights[1], 
-                        cluster_weights[2], cluster_weights[3]))
-
-            self.cluster_weights = {}
-            self.cluster_weights["rate"] =  float(eval(cluster_weights[0]))
-            self.cluster_weights["freqs"] = float(eval(cluster_weights[1]))
-            self.cluster_weights["model"] = float(eval(cluster_weights[2]))
-            self.cluster_weights["alpha"] = float(eval(cluster_weights[3]))
+            self.cluster_weights = self.parse_cluster_weights(cluster_weights)
 
         #check that cluster_percent is 0-100
         try:
@@ -138,6 +121,195 @@ class Configuration(object):
 
         log.info("Setting rcluster-percent to %.2f" % self.cluster_percent)
 
+        if cluster_start_percent is not None:
+            cluster_start_percent = float(cluster_start_percent)
+            if cluster_start_percent <= 0.0 or \
+                    cluster_start_percent > self.cluster_percent:
+                log.error("The rcluster-start-percent must be more than 0.0 "
+                          "and no more than the rcluster-percent (%.2f), "
+                          "yours is %.2f. Please check and try again."
+                          % (self.cluster_percent, cluster_start_percent))
+                raise ConfigurationError
+            log.info("Setting rcluster-start-percent to %.2f"
+                     % cluster_start_percent)
+        self.cluster_start_percent = cluster_start_percent
+
+        if cluster_max is not None:
+            if cluster_max < 1:
+                log.error("The rcluster-max must be at least 1, yours is %d. "
+                          "Please check and try again." % cluster_max)
+                raise ConfigurationError
+            log.info("Setting rcluster-max to %d" % cluster_max)
+        self.cluster_max = cluster_max
+
+        if screen_margin is not None:
+            screen_margin = float(screen_margin)
+            if screen_margin < 0.0:
+                log.error("The screen-margin must be zero or more, yours "
+                          "is %.2f. Please check and try again." % screen_margin)
+                raise ConfigurationError
+            log.info("Screening models at low precision, and keeping those "
+                     "within %.2f of the best" % screen_margin)
+        self.screen_margin = screen_margin
+
+        if search_models is not None:
+            search_models = [x.strip() for x in search_models.split(",")]
+            if datatype == "DNA":
+                valid_models = self.processor.models.get_all_dna_models()
+            else:
+                valid_models = self.processor.models.get_all_protein_models()
+            for m in search_models:
+                if m not in valid_models:
+                    log.error("'%s' in your --search-models argument is not a "
+                              "valid model for %s data. Please check the lists "
+                              "of valid models in the manual and try again",
+                              m, datatype)
+                    raise ConfigurationError
+            log.info("Searching for the best scheme using the models: %s",
+                     ", ".join(search_models))
+        self.search_models = search_models
+
+        if sample_percent is not None:
+            sample_percent = float(sample_percent)
+            if sample_percent <= 0.0 or sample_percent > 100.0:
+                log.error("The sample-percent must be more than 0.0 and at "
+                          "most 100.0, yours is %.2f. Please check and try "
+                          "again." % sample_percent)
+                raise ConfigurationError
+            if sample_promote < 1:
+                log.error("The sample-promote must be at least 1, yours is %d. "
+                          "Please check and try again." % sample_promote)
+                raise ConfigurationError
+            log.info("Screening schemes on %.2f percent of the sites, and "
+                     "analysing the best %d of them on all the sites" %
+                     (sample_percent, sample_promote))
+        self.sample_percent = sample_percent
+        self.sample_promote = sample_promote
+
+        if prescreen is not None:
+            if prescreen < 1:
+                log.error("The prescreen must be at least 1, yours is %d. "
+                          "Please check and try again." % prescreen)
+                raise ConfigurationError
+            try:
+                import numpy
+            except ImportError:
+                log.error("The --prescreen option needs the numpy library. "
+                          "Please install it (e.g. 'pip install numpy') and "
+                          "try again.")
+                raise ConfigurationError
+            # We count the site patterns with numpy.unique(axis=0)
+            version = tuple(
+                [int(x) for x in numpy.__version__.split('.')[:2]])
+            if version < (1, 13):
+                log.error("The --prescreen option needs numpy 1.13 or later, "
+                          "you have %s. Please upgrade it (e.g. 'pip install "
+                          "--upgrade numpy') and try again.",
+                          numpy.__version__)
+                raise ConfigurationError
+            log.info("Prescreening schemes with a quick likelihood "
+                     "calculation, and analysing the best %d of them"
+                     % prescreen)
+        self.prescreen = prescreen
+
+        if cluster_neighbours is not None:
+            if cluster_neighbours < 1:
+                log.error("The cluster-neighbours must be at least 1, yours "
+                          "is %d. Please check and try again."
+                          % cluster_neighbours)
+                raise ConfigurationError
+            log.info("Clustering using the %d nearest neighbours of each "
+                     "subset" % cluster_neighbours)
+        self.cluster_neighbours = cluster_neighbours
+
+        if subset_cache is None:
+            subset_cache = subset.DEFAULT_CACHE_SIZE
+        elif subset_cache < 0:
+            log.error("The subset-cache must be zero or more, yours is %d. "
+                      "Please check and try again." % subset_cache)
+            raise ConfigurationError
+        else:
+            log.info("Keeping the %d most recently used subsets in memory"
+                     % subset_cache)
+        subset.recent_subsets.size = subset_cache
+        self.subset_cache = subset_cache
+
+        # We can only find this once we've read the .cfg file
+        if start_scheme is not None:
+            log.info("Setting start-scheme to '%s'" % start_scheme)
+        self.start_scheme = start_scheme
+
+        if reoptimise and not incremental:
+            log.error("The --reoptimise option only works with --incremental. "
+                      "Please check and try again.")
+            raise ConfigurationError
+        if incremental:
+            log.info("Only searching moves involving new data blocks%s",
+                     ", then re-optimising the whole scheme" if reoptimise
+                     else "")
+        self.incremental = incremental
+        self.reoptimise = reoptimise
+
+        # Settings to sweep over, each a list of values to try. We can only
+        # check them against the search once we've read the .cfg file
+        self.sweep = []
+        if sweep_model_selection is not None:
+            values = [x.strip().lower()
+                      for x in sweep_model_selection.split(",")]
+            for v in values:
+                if v not in self.options['model_selection']:
+                    log.error("'%s' in your --sweep-model-selection argument "
+                              "is not a valid model_selection. The only "
+                              "valid options are: %s", v,
+                              ", ".join(self.options['model_selection']))
+                    raise ConfigurationError
+            self.sweep.append(('model_selection', values))
+        if sweep_cluster_percent is not None:
+            values = []
+            for x in sweep_cluster_percent.split(","):
+                try:
+                    v = float(x)
+                    assert 0.0 <= v <= 100.0
+                except:
+                    log.error("'%s' in your --sweep-rcluster-percent argument "
+                              "is not a number from 0.0 to 100.0. Please "
+                              "check and try again.", x.strip())
+                    raise ConfigurationError
+                if self.cluster_start_percent is not None and \
+                        v < self.cluster_start_percent:
+                    log.error("The rcluster-start-percent (%.2f) is more than "
+                              "%.2f in your --sweep-rcluster-percent "
+                              "argument. Please check and try again.",
+                              self.cluster_start_percent, v)
+                    raise ConfigurationError
+                values.append(v)
+            self.sweep.append(('cluster_percent', values))
+        if sweep_cluster_weights is not None:
+            values = [self.parse_cluster_weights(x)
+                      for x in sweep_cluster_weights.split(";")]
+            self.sweep.append(('cluster_weights', values))
+        if self.sweep and incremental:
+            log.error("You can't sweep over settings in an incremental "
+                      "analysis. Please check and try again.")
+            raise ConfigurationError
+
+        # The name of the settings we're using in a sweep
+        self.sweep_name = None
+
+        # Whether the settings are the same as in the previous analysis
+        self.same_settings = False
+
+        # The names of the data blocks added since the previous analysis,
+        # which we only know about in an incremental analysis
+        self.new_blocks = None
+
+        # A digest of the settings that the results of every subset depend
+        # on, which the analysis works out once it has the starting tree
+        self.cache_digest = None
+
+        # Where the subsets keep their results, which the analysis opens
+        self.result_store = None
+
         # Set the defaults into the class. These can be reset by calling
         # set_option(...)
         for o, v in self.options.items():
@@ -157,6 +329,43 @@ class Configuration(object):
         util.program_path = pth
         log.info("Program path is here %s", self.program_path)
 
+    def parse_cluster_weights(self, cluster_weights):
+        # TODO. Is there a more robust way to do this...
+        # Brett say "YES. But this will do for now..."
+        cluster_weights = [x.strip() for x in cluster_weights.split(",")]
+
+        #now we check that it's a list of exactly four numbers
+        if len(cluster_weights) != 4:
+            log.error("Your --cluster_weights argument should have exactly 4"
+                      " numbers separated by commas, but it has %d ('%s') "
+                      "Please check and try again", len(cluster_weights), cluster_weights)
+            raise ConfigurationError
+
+        for thing in cluster_weights:
+            try:
+                num = float(eval(thing))
+                assert num >= 0
+            except:
+                log.error("Unable to understand your --cluster_weights argument."
+                          " It should look like this: --cluster_weights '1,2,3,6'. "
+                          "Please double check that you included quotes, "
+                          "and four numbers greater than or equal to zero "
+                          "separated by commas. Then try again. "
+                          "The part that I couldn't understand is this: '%s'" % thing)
+                raise ConfigurationError
+
+        log.info("Setting cluster_weights to: "
+                 "subset_rate = %s, freqs = %s, model = %s, alpha %s" 
+                 % (cluster_weights[0], cluster_weights[1], 
+                    cluster_weights[2], cluster_weights[3]))
+
+        weights = {}
+        weights["rate"] =  float(eval(cluster_weights[0]))
+        weights["freqs"] = float(eval(cluster_weights[1]))
+        weights["model"] = float(eval(cluster_weights[2]))
+        weights["alpha"] = float(eval(cluster_weights[3]))
+        return weights
+
     def reset(self):
         if self.old_cwd is not None:
             log.debug("Returning to original path: %s", self.old_cwd)
@@ -294,12 +503,69 @@ class Configuration(object):
                       " See the manual for more details.")
             raise ConfigurationError
 
+        if option == "search" and "cluster" in value:
+            try:
+                import numpy
+            except ImportError:
+                log.error("Clustering methods need the numpy library. Please "
+                          "install it (e.g. 'pip install numpy') and try again.")
+                raise ConfigurationError
+
         log.info("Setting '%s' to '%s'", option, value)
         setattr(self, option, value)
 
+    def get_sweep(self):
+        """Every combination of the settings we're sweeping over, as a list
+        of (name, settings) pairs, or None if there isn't a sweep"""
+        if not self.sweep:
+            return None
+
+        for option, values in self.sweep:
+            if option == 'cluster_percent':
+                searches = ['rcluster']
+            elif option == 'cluster_weights':
+                searches = ['hcluster', 'rcluster']
+            else:
+                continue
+            if self.search not in searches:
+                log.error("Sweeping over the %s only makes sense for %s "
+                          "searches, not '%s'", option.replace('_', ' '),
+                          " and ".join(searches), self.search)
+                raise ConfigurationError
+
+        sweep = [("", {})]
+        for option, values in self.sweep:
+            combined = []
+            for name, settings in sweep:
+                for v in values:
+                    new_settings = dict(settings)
+                    new_settings[option] = v
+                    new_name = "-".join(
+                        [x for x in (name, get_sweep_label(option, v)) if x])
+                    combined.append((new_name, new_settings))
+            sweep = combined
+        return sweep
+
+    def use_sweep_settings(self, name, settings):
+        """Change to one of the settings from a sweep. Each of them gets its
+        own schemes folder, and best scheme"""
+        log.info("Using the sweep settings '%s'", name)
+        for option, v in settings.items():
+            setattr(self, option, v)
+        self.sweep_name = name
+        self.schemes_path = os.path.join(self.output_path, 'schemes', name)
+        util.make_dir(self.schemes_path)
+
     def validate(self):
         """Should be called before processing"""
-        # Just path validation for now.
+        # Only the searches that move from scheme to scheme can start from
+        # one
+        if self.start_scheme is not None and self.search in ['all', 'user']:
+            log.error("You can't use --start-scheme with the '%s' search, "
+                      "only with the greedy, hcluster and rcluster searches",
+                      self.search)
+            raise ConfigurationError
+
         util.check_folder_exists(self.base_path)
         self.alignment_path = os.path.join(self.base_path, self.alignment)
         log.info("Looking for alignment file '%s'...", self.alignment_path)
@@ -313,96 +579,80 @@ class Configuration(object):
                 "Looking for tree file '%s'...", self.user_tree_topology_path)
             util.check_file_exists(self.user_tree_topology_path)
 
-    def check_for_old_config(self):
-        """Check whether the analysis dictated by cfg has been run before, and if the config has changed
-        in any way that would make re-running it invalid"""
+    def get_config_list(self):
         #the important stuff in our analysis, that can't change if we want to re-use old subsets
-        log.info("Checking previously run configuration data...")
         if self.user_tree is None:
             topology = ""
         else:
             topology = open(self.user_tree_topology_path).read()
 
-        cfg_list = [self.alignment,
-                    self.branchlengths,
-                    self.partitions.partitions,
-                    self.phylogeny_program,
-                    topology]
-
-        #we need to know if there's anything in the subsets folder
-        subset_path = os.path.join(self.output_path, 'subsets')
-        has_subsets = False
-        if os.path.exists(subset_path):
-            #EAFP: we try to delete the file then see if os.rmdir spits an error...
-            try:
-                os.rmdir(subset_path)
-            except OSError as ex:
-                if ex.errno == errno.ENOTEMPTY:
-                    has_subsets = True
+        return [self.alignment,
+                self.branchlengths,
+                self.partitions.partitions,
+                self.phylogeny_program,
+                topology]
 
+    def write_old_config(self):
+        """Store the settings, so we can check them in the next analysis"""
+        cfg_dir = os.path.join(self.output_path, 'cfg')
+        if not os.path.exists(cfg_dir):
+            os.makedirs(cfg_dir)
+        #store a nice binary
+        f = open(os.path.join(cfg_dir, 'oldcfg.bin'), 'wb')
+        pickle.dump(self.get_config_list(), f, -1)
+        f.close()
 
+    def check_for_old_config(self):
+        """Compare the settings with those of the previous analysis
 
-        #we also need to know if there's an old conifg file saved
-        cfg_dir = os.path.join(self.output_path, 'cfg')
-        old_cfg_path = os.path.join(cfg_dir, 'oldcfg.bin')
-        if os.path.exists(old_cfg_path):
-            has_config = True
+        The subsets are stored under a digest of the data and the settings
+        that their results depend on, so changing the settings never makes
+        the stored subsets wrong: the ones that are affected just get analysed
+        again. For an incremental analysis we work out which data blocks are
+        new."""
+        log.info("Checking previously run configuration data...")
+        cfg_list = self.get_config_list()
+
+        old_cfg_path = os.path.join(self.output_path, 'cfg', 'oldcfg.bin')
+        if not os.path.exists(old_cfg_path):
+            self.write_old_config()
+            return
+
+        f = open(old_cfg_path, 'rb')
+        old_cfg = pickle.load(f)
+        f.close()
+
+        if len(old_cfg) != len(cfg_list):
+            # Probably from a different version of PartitionFinder
+            log.info("The previous analysis was set up differently, so "
+                     "only the subsets it shares with this one will be used")
+            old_cfg = [None] * len(cfg_list)
+
+        changed = []
+        if not old_cfg[0] == cfg_list[0]:
+            changed.append("alignment")
+        if not old_cfg[1] == cfg_list[1]:
+            changed.append("branchlengths")
+        old_parts = set([str(part) for part in old_cfg[2] or []])
+        new_parts = set([str(part) for part in cfg_list[2]])
+        if old_parts != new_parts:
+            changed.append("[data_blocks]")
+        if not old_cfg[3] == cfg_list[3]:
+            changed.append(
+                "phylogeny_program (the --raxml commandline option)")
+        if not old_cfg[4] == cfg_list[4]:
+            changed.append("user_tree_topology")
+
+        self.same_settings = not changed
+        if changed:
+            log.info("These settings have changed since the previous "
+                     "analysis: %s. Only the subsets they affect will be "
+                     "analysed again", ", ".join(changed))
+
+        if self.incremental:
+            # Blocks whose definition changed count as new ones. The
+            # settings are stored once the analysis is finished.
+            self.new_blocks = set([part.name for part in cfg_list[2]
+                                   if str(part) not in old_parts])
         else:
-            has_config = False
-
-        if not has_subsets:
-            #we have no subsets so can't screw anything up, just copy the new cfg file settings, overwrite anything else
-            if not os.path.exists(cfg_dir):
-                os.makedirs(cfg_dir)
-            #store a nice binary
-            f = open(old_cfg_path, 'wb')
-            pickle.dump(cfg_list, f, -1)
-            f.close()
-            return 0
-
-        else:  # there are subsets
-            if not has_config:
-                log.error("There are subsets stored, but PartitionFinder can't determine where they are from")
-                log.info("Please re-run the analysis using the '--force-restart' option at the command line")
-                log.warning("This will delete all of the analyses in the '/analysis' folder")
-                raise ConfigurationError
-            else:
-                #we have an old config, load it and compare the important bits
-                f = open(old_cfg_path, 'rb')
-                old_cfg = pickle.load(f)
-                f.close()
-                fail = []
-
-                if len(old_cfg) != len(cfg_list):
-                    log.error("Your old configuration doesn't match with your new one")
-                    log.error("The most common cause of this error is trying to run a half-finished analysis"
-                              " but switching PartitionFinder versions half way through")
-                    log.error("The solution is to either go back to the same version of PartitionFinder"
-                              " you used for the initial analysis, or to re-run the analysis using the "
-                              "--force-restart option at the command line. Note that this will delete "
-                              "all previous analyses in the '/analysis' folder")
-
-                if not old_cfg[0] == cfg_list[0]:
-                    log.error("Old Alignment %s not equal to new alignment %s", old_cfg[0], cfg_list[0])
-                    fail.append("alignment")
-                if not old_cfg[1] == cfg_list[1]:
-                    fail.append("branchlengths")
-
-                old_parts = set([str(part) for part in old_cfg[2]])
-                new_parts = set([str(part) for part in cfg_list[2]])
-                if len(old_parts.difference(new_parts)) > 0:
-                    fail.append("[data_blocks]")
-
-                if not old_cfg[3] == cfg_list[3]:
-                    fail.append(
-                        "phylogeny_program (the --raxml commandline option)")
-
-                if not old_cfg[4] == cfg_list[4]:
-                    fail.append("user_tree_topology")
-
-                if len(fail) > 0:
-                    log.error("There are subsets stored, but PartitionFinder has detected that these were run using a different .cfg setup")
-                    log.error("The following settings in the new .cfg file are incompatible with the previous analysis: %s" % (', '.join(fail)))
-                    log.info("To run this analysis and overwrite previous output, re-run the analysis using '--force-restart' option")
-                    log.info("To run this analysis without deleting the previous analysis, please place your alignment and .cfg in a new folder and try again")
-                    raise ConfigurationError
+            self.write_old_config()
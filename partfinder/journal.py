@@ -0,0 +1,71 @@
+#Copyright (C) 2012 Robert Lanfear and Brett Calcott
+#
+#This program is free software: you can redistribute it and/or modify it
+#under the terms of the GNU General Public License as published by the
+#Free Software Foundation, either version 3 of the License, or (at your
+#option) any later version.
+#
+#This program is distributed in the hope that it will be useful, but
+#WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#General Public License for more details. You should have received a copy
+#of the GNU General Public License along with this program.  If not, see
+#<http://www.gnu.org/licenses/>. PartitionFinder also includes the PhyML
+#program, the RAxML program, and the PyParsing library,
+#all of which are protected by their own licenses and conditions, using
+#PartitionFinder implies that you agree with those licences and conditions as well.
+
+import logging
+log = logging.getLogger("journal")
+
+import os
+import cPickle as pickle
+
+
+class SearchJournal(object):
+    """Records how far a search has got as it goes, so that an analysis that
+    was stopped can carry on from the first step it didn't finish.
+
+    The journal is only used if the key matches, which is a digest of
+    everything that could change the path the search takes.
+    """
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.state = None
+
+    def load(self):
+        """Read the journal, returning the state it recorded, if it belongs
+        to this analysis"""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            f = open(self.path, 'rb')
+            key, state = pickle.load(f)
+            f.close()
+        except Exception:
+            # Probably stopped while we were writing it
+            log.warning("Couldn't read the search journal in '%s'", self.path)
+            return None
+        if key != self.key:
+            log.info("The search journal is from a different analysis, so "
+                     "we'll start the search from the beginning")
+            return None
+        self.state = state
+        return state
+
+    def record(self, **state):
+        """Write the state of the search"""
+        self.state = state
+        # Write it somewhere else first, so stopping half way through never
+        # leaves us with a broken journal
+        tmp_path = self.path + '.tmp'
+        f = open(tmp_path, 'wb')
+        pickle.dump((self.key, state), f, -1)
+        f.close()
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Windows won't rename over an existing file
+            os.remove(self.path)
+            os.rename(tmp_path, self.path)
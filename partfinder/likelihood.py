@@ -0,0 +1,274 @@
+#Copyright (C) 2012 Robert Lanfear and Brett Calcott
+#
+#This program is free software: you can redistribute it and/or modify it
+#under the terms of the GNU General Public License as published by the
+#Free Software Foundation, either version 3 of the License, or (at your
+#option) any later version.
+#
+#This program is distributed in the hope that it will be useful, but
+#WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#General Public License for more details. You should have received a copy
+#of the GNU General Public License along with this program.  If not, see
+#<http://www.gnu.org/licenses/>. PartitionFinder also includes the PhyML
+#program, the RAxML program, the PyParsing library, and the python-cluster library
+#all of which are protected by their own licenses and conditions, using
+#PartitionFinder implies that you agree with those licences and conditions as well.
+
+"""Quick and approximate likelihoods of subsets, without phyml or raxml
+
+We use the F81 model (for amino acids, the equivalent model with 20 states),
+with empirical frequencies and a single rate multiplier, on the fixed starting
+tree. The numbers are nowhere near as good as the ones from phyml or raxml,
+but they are cheap enough to compare lots of candidate subsets before we run
+anything else.
+"""
+
+import logging
+log = logging.getLogger("likelihood")
+
+import numpy
+
+from util import PartitionFinderError
+
+
+class LikelihoodError(PartitionFinderError):
+    pass
+
+
+_states = {
+    "DNA": "ACGT",
+    "protein": "ARNDCQEGHILKMFPSTWYV",
+}
+
+_ambiguities = {
+    "DNA": {
+        "U": "T", "R": "AG", "Y": "CT", "S": "CG", "W": "AT", "K": "GT",
+        "M": "AC", "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG",
+    },
+    "protein": {
+        "B": "ND", "Z": "QE", "J": "IL",
+    },
+}
+
+
+class Node(object):
+    def __init__(self):
+        self.name = None
+        self.length = 0.0
+        self.children = []
+
+
+def parse_newick(text):
+    """Read a tree with branch lengths, returning the root Node"""
+    text = text.strip()
+    pos = [0]
+
+    def peek():
+        if pos[0] < len(text):
+            return text[pos[0]]
+        return ';'
+
+    def read_label():
+        start = pos[0]
+        if peek() == "'":
+            end = text.index("'", start + 1)
+            pos[0] = end + 1
+            return text[start + 1:end]
+        while peek() not in "(),:;":
+            pos[0] += 1
+        return text[start:pos[0]].strip()
+
+    def read_node():
+        node = Node()
+        if peek() == '(':
+            pos[0] += 1
+            node.children.append(read_node())
+            while peek() == ',':
+                pos[0] += 1
+                node.children.append(read_node())
+            if peek() != ')':
+                log.error("Badly formed tree at character %d", pos[0])
+                raise LikelihoodError
+            pos[0] += 1
+        # Internal nodes can have labels (e.g. support values) too
+        label = read_label()
+        if not node.children:
+            node.name = label
+        if peek() == ':':
+            pos[0] += 1
+            length = read_label()
+            try:
+                node.length = float(length)
+            except ValueError:
+                log.error("Bad branch length '%s' in tree", length)
+                raise LikelihoodError
+        return node
+
+    return read_node()
+
+
+def read_tree(tree_path):
+    return parse_newick(open(tree_path).read())
+
+
+class LikelihoodEngine(object):
+    """Calculates approximate likelihoods for subsets of an alignment"""
+
+    # How closely we find the best rate multiplier, in log units
+    TOLERANCE = 0.01
+
+    def __init__(self, alignment, tree_path, datatype):
+        self.states = _states[datatype]
+        self.nstates = len(self.states)
+        self.make_partials_table(datatype)
+
+        root = read_tree(tree_path)
+
+        # Flatten the tree into a postorder list of (node, children, length),
+        # with the tips first, so the calculation is just one loop
+        names = alignment.names
+        tip_index = dict([(nm, i) for i, nm in enumerate(names)])
+        self.tip_count = len(names)
+        self.postorder = []
+        found = set()
+        self.root_index = self.flatten(root, tip_index, found)
+        missing = set(names) - found
+        if missing:
+            log.error("These species are not in the starting tree: %s",
+                      ", ".join(missing))
+            raise LikelihoodError
+
+        # The sequences as a taxa x sites array of character codes, which is
+        # how the alignment already holds them
+        self.codes = alignment.matrix
+
+        self.scores = {}
+
+    def flatten(self, node, tip_index, found):
+        if not node.children:
+            if node.name not in tip_index:
+                log.error("Species '%s' in the starting tree is not in the "
+                          "alignment", node.name)
+                raise LikelihoodError
+            found.add(node.name)
+            return tip_index[node.name]
+
+        children = [(self.flatten(c, tip_index, found), c.length)
+                    for c in node.children]
+        index = self.tip_count + len(self.postorder)
+        self.postorder.append((index, children))
+        return index
+
+    def make_partials_table(self, datatype):
+        """What each character in the alignment says about the state"""
+        # Anything we don't know about is treated as missing data
+        table = numpy.ones((256, self.nstates))
+        for i, s in enumerate(self.states):
+            row = numpy.zeros(self.nstates)
+            row[i] = 1.0
+            table[ord(s)] = row
+            table[ord(s.lower())] = row
+        for code, possible in _ambiguities[datatype].items():
+            row = numpy.zeros(self.nstates)
+            for s in possible:
+                row[self.states.index(s)] = 1.0
+            table[ord(code)] = row
+            table[ord(code.lower())] = row
+        self.table = table
+
+    def get_patterns(self, columns):
+        """The unique site patterns in the columns, and how often they occur"""
+        cols = self.codes[:, numpy.asarray(columns)].T
+        patterns, counts = numpy.unique(cols, axis=0, return_counts=True)
+        return patterns.T, counts.astype(float)
+
+    def get_frequencies(self, tip_partials, counts):
+        # Only count the sites where we know what the state is
+        freqs = numpy.zeros(self.nstates)
+        for partials in tip_partials:
+            known = partials.sum(axis=1) == 1.0
+            freqs += (partials[known] * counts[known, None]).sum(axis=0)
+        # Never let a state have a frequency of zero
+        freqs += 1.0
+        return freqs / freqs.sum()
+
+    def calculate_lnl(self, tip_partials, counts, freqs, rate):
+        """F81 pruning over all the site patterns at once
+
+        For F81, P(t)L = e.L + (1 - e)(pi.L), where e = exp(-beta.t), so we
+        never need the transition matrices.
+        """
+        beta = 1.0 / (1.0 - (freqs ** 2).sum())
+        partials = list(tip_partials) + [None] * len(self.postorder)
+        log_scale = numpy.zeros(len(counts))
+        for index, children in self.postorder:
+            node = None
+            for child, length in children:
+                L = partials[child]
+                e = numpy.exp(-beta * rate * length)
+                P = e * L + (1.0 - e) * L.dot(freqs)[:, None]
+                if node is None:
+                    node = P
+                else:
+                    node = node * P
+            # Scale to stop underflow
+            scale = node.max(axis=1)
+            node = node / scale[:, None]
+            log_scale += numpy.log(scale)
+            partials[index] = node
+
+        site_lnl = numpy.log(partials[self.root_index].dot(freqs)) + log_scale
+        return (site_lnl * counts).sum()
+
+    def get_lnl(self, columns):
+        """The likelihood of the columns, with the best rate multiplier"""
+        patterns, counts = self.get_patterns(columns)
+        tip_partials = self.table[patterns]
+        freqs = self.get_frequencies(tip_partials, counts)
+
+        def f(log_rate):
+            return -self.calculate_lnl(
+                tip_partials, counts, freqs, numpy.exp(log_rate))
+
+        # Golden section search over the log of the rate multiplier
+        ratio = (numpy.sqrt(5.0) - 1.0) / 2.0
+        a, b = numpy.log(0.001), numpy.log(1000.0)
+        c = b - ratio * (b - a)
+        d = a + ratio * (b - a)
+        fc, fd = f(c), f(d)
+        while b - a > self.TOLERANCE:
+            if fc < fd:
+                b, d, fd = d, c, fc
+                c = b - ratio * (b - a)
+                fc = f(c)
+            else:
+                a, c, fc = c, d, fd
+                d = a + ratio * (b - a)
+                fd = f(d)
+
+        return -min(fc, fd)
+
+    def get_score(self, sub, model_selection):
+        """The approximate information score of a subset"""
+        key = (sub.mask, model_selection)
+        score = self.scores.get(key, None)
+        if score is None:
+            lnl = self.get_lnl(sub.columns)
+            # The frequencies, and the rate multiplier
+            K = float(self.nstates)
+            n = float(len(sub.columns))
+            score = get_info_score(model_selection, lnl, K, n)
+            self.scores[key] = score
+        return score
+
+
+def get_info_score(model_selection, lnl, K, n):
+    # The same as in Subset.add_result
+    if model_selection == "aic":
+        return (-2.0 * lnl) + (2.0 * K)
+    if model_selection == "bic":
+        return (-2.0 * lnl) + (K * numpy.log(n))
+    if n < (K + 2):
+        n = K + 2
+    return (-2.0 * lnl) + ((2.0 * K) * (n / (n - K - 1.0)))
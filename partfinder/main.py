@@ -45,6 +45,7 @@ import datetime
 import parser
 import raxml
 import phyml
+import subset
 from partfinder import current
 
 
@@ -201,6 +202,144 @@ def parse_args(datatype, cmdargs=None):
         "e.g. --cluster-percent 10.0"
 
     )
+    op.add_option(
+        "--rcluster-start-percent",
+        type="float", dest="cluster_start_percent", default=None, metavar="N",
+        help="Start each step of the relaxed clustering algorithm by looking "
+        "at only N percent of the possible schemes. The share is doubled, up "
+        "to the --rcluster-percent, only when none of the schemes looked at "
+        "so far improve the score. e.g. --rcluster-start-percent 1.0"
+    )
+    op.add_option(
+        "--rcluster-max",
+        type="int", dest="cluster_max", default=None, metavar="N",
+        help="The most schemes the relaxed clustering algorithm will look at "
+        "in each step, whatever the --rcluster-percent. e.g. --rcluster-max 1000"
+    )
+    op.add_option(
+        "--prune-models",
+        action="store_true", dest="prune_models",
+        help="Don't run models that can't possibly be selected for a subset. "
+        "A model is skipped if its information score could not beat the best "
+        "score already found for that subset even with a perfect likelihood, "
+        "or if the subset has too few sites to calculate its AICc. This can "
+        "save a lot of time on small subsets with large numbers of models."
+    )
+    op.add_option(
+        "--screen-margin",
+        type="float", dest="screen_margin", default=None, metavar="N",
+        help="Screen every model on every subset by first estimating the "
+        "likelihood at low precision. Only the models whose information "
+        "score is within N units of the best one for that subset are then "
+        "analysed at full precision. e.g. --screen-margin 10.0"
+    )
+    op.add_option(
+        "--search-models",
+        type="str", dest="search_models", default=None, metavar="MODELS",
+        help="A list of models to use while searching for the best scheme, "
+        "e.g. --search-models 'GTR+G'. Model selection with the full list of "
+        "models from the .cfg file is then only done on the subsets of the "
+        "best scheme. This can make greedy and rcluster searches much quicker."
+    )
+    op.add_option(
+        "--sample-percent",
+        type="float", dest="sample_percent", default=None, metavar="N",
+        help="For greedy and rcluster searches. Score every candidate scheme "
+        "at each step on a fixed random sample of N percent of the sites of "
+        "each subset, and only analyse the most promising ones (see "
+        "--sample-promote) on all of the sites. This can save a lot of time "
+        "with very long alignments. e.g. --sample-percent 10.0"
+    )
+    op.add_option(
+        "--sample-promote",
+        type="int", dest="sample_promote", default=5, metavar="N",
+        help="The number of candidate schemes at each step of the search that "
+        "are analysed on all the sites when using --sample-percent. "
+        "The default is 5."
+    )
+    op.add_option(
+        "--prescreen",
+        type="int", dest="prescreen", default=None, metavar="N",
+        help="For greedy and rcluster searches. Rank the candidate schemes at "
+        "each step with a quick, approximate likelihood calculation (the F81 "
+        "model on the starting tree) that doesn't need phyml or raxml, and "
+        "only analyse the best N of them. This needs the numpy library. "
+        "e.g. --prescreen 10"
+    )
+    op.add_option(
+        "--start-scheme",
+        type="str", dest="start_scheme", default=None, metavar="SCHEME",
+        help="Start the greedy, hcluster or rcluster search from this scheme, "
+        "rather than from the scheme with every data block in its own subset. "
+        "This can be the name of one of the schemes in the [schemes] section "
+        "of the .cfg file, or a file with a scheme in it, such as the "
+        "best_scheme.txt of an earlier analysis. "
+        "e.g. --start-scheme analysis/best_scheme.txt"
+    )
+    op.add_option(
+        "--incremental",
+        action="store_true", dest="incremental",
+        help="Re-use a previous analysis after adding (or removing) data "
+        "blocks, and loci at the end of the alignment. The search starts from "
+        "the best scheme of the previous analysis (or the --start-scheme), "
+        "with each new data block in its own subset, and only looks at "
+        "merging subsets that contain new data blocks. The data blocks from "
+        "the previous analysis must not change."
+    )
+    op.add_option(
+        "--reoptimise",
+        action="store_true", dest="reoptimise",
+        help="For --incremental analyses. When merging the new data blocks "
+        "no longer improves the score, carry on searching all of the schemes "
+        "from the best one found so far."
+    )
+    op.add_option(
+        "--cluster-neighbours",
+        type="int", dest="cluster_neighbours", default=None, metavar="N",
+        help="For hcluster and rcluster searches with thousands of subsets. "
+        "Only keep track of the N closest subsets to each subset, rather "
+        "than the distances between every pair of subsets, which saves a lot "
+        "of memory. hcluster gives the same results for any N. rcluster "
+        "gives the same results as long as N is at least the number of "
+        "schemes it looks at in each step (see --rcluster-percent). "
+        "e.g. --cluster-neighbours 50"
+    )
+    op.add_option(
+        "--sweep-model-selection",
+        type="str", dest="sweep_model_selection", default=None,
+        metavar="METHODS",
+        help="Run the search once for each of these model_selection "
+        "methods, writing a best_scheme_<settings>.txt for each one, and "
+        "a sweep_summary.txt. All of the searches share the subsets they "
+        "analyse, but they run one after another, not at the same time. "
+        "e.g. --sweep-model-selection 'aic, aicc, bic'"
+    )
+    op.add_option(
+        "--sweep-rcluster-percent",
+        type="str", dest="sweep_cluster_percent", default=None,
+        metavar="N,N,...",
+        help="For rcluster searches. Run the search once for each of these "
+        "rcluster-percent values, as for --sweep-model-selection. "
+        "e.g. --sweep-rcluster-percent '10, 50'"
+    )
+    op.add_option(
+        "--sweep-weights",
+        type="str", dest="sweep_cluster_weights", default=None,
+        metavar="WEIGHTS;WEIGHTS;...",
+        help="For hcluster and rcluster searches. Run the search once for "
+        "each of these sets of --weights, separated by semicolons, as for "
+        "--sweep-model-selection. e.g. --sweep-weights '1,0,0,0; 1,1,1,1'. "
+        "Every combination of the sweep options is run."
+    )
+    op.add_option(
+        "--subset-cache",
+        type="int", dest="subset_cache", default=None, metavar="N",
+        help="Keep the N most recently used subsets in memory, even when "
+        "nothing else needs them, so they don't have to be read back in from "
+        "the subsets folder. How much memory each one takes depends on how "
+        "many models it has results for. Use 0 to keep only the subsets still in use, which saves memory on "
+        "very large analyses. The default is %d." % subset.DEFAULT_CACHE_SIZE
+    )
     op.add_option(
         '--debug-output',
         type='string',
@@ -234,6 +373,12 @@ def check_options(op, options):
     if options.dump_results and options.compare_results:
         op.error("options --dump_results and --compare_results are mutually exclusive!")
 
+    if options.dump_results or options.compare_results:
+        if options.sweep_model_selection or options.sweep_cluster_percent \
+                or options.sweep_cluster_weights:
+            op.error("options --dump_results and --compare_results can't be "
+                     "used with a sweep")
+
     if options.verbose:
         set_debug_regions(['all'])
     else:
@@ -313,7 +458,23 @@ def main(name, datatype, passed_args=None):
                                    options.save_phylofiles, 
                                    options.cmdline_extras,
                                    options.cluster_weights,
-                                   options.cluster_percent)
+                                   options.cluster_percent,
+                                   options.prune_models,
+                                   options.screen_margin,
+                                   options.search_models,
+                                   options.sample_percent,
+                                   options.sample_promote,
+                                   options.prescreen,
+                                   options.cluster_neighbours,
+                                   options.cluster_start_percent,
+                                   options.cluster_max,
+                                   options.start_scheme,
+                                   options.incremental,
+                                   options.reoptimise,
+                                   options.sweep_model_selection,
+                                   options.sweep_cluster_percent,
+                                   options.sweep_cluster_weights,
+                                   options.subset_cache)
 
         # Set up the progress callback
         progress.TextProgress(cfg)
@@ -17,169 +17,485 @@
 
 import subset
 import scheme
-from algorithm import euclidean_distance
+
+import math
+import numpy
 
 import logging
 log = logging.getLogger("cluster")
 
 
-def get_ranked_list(final_distances):
+class DistanceMatrix(object):
+    """The weighted, normalised distances between the subsets of a scheme
+
+    We keep the distances for each kind of parameter separately, so that when
+    the scheme changes we only have to work out the distances for the new
+    subsets. Each subset has a slot (a row and column in the matrices). The
+    slots of subsets that have gone are reused, or left empty, with all their
+    distances set to zero.
     """
-    Return the closest subsets defined by a distance matrix usually there will
-    just be a pair that's closer than all other pairs BUT, it's feasible (if
-    unlikely) that >2 subsets are equally close.  This is possible if, e.g. all
-    weights are zero. Then we just want to group all the equally close
-    subsets...
 
-    So, we return a list of all the closest subsets
+    families = ["rate", "freqs", "model", "alpha"]
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.subsets = []
+        self.slots = {}
+
+    def build(self, subsets):
+        self.set_params(subsets)
+
+        size = len(self.subsets)
+        self.dists = {}
+        self.row_max = {}
+        self.row_arg = {}
+        for f in self.families:
+            d = numpy.zeros((size, size))
+            for i in range(size - 1):
+                d[i, i + 1:] = self.get_distances(f, i, slice(i + 1, size))
+            d += d.T
+            self.dists[f] = d
+            self.row_arg[f] = d.argmax(axis=1)
+            self.row_max[f] = d[numpy.arange(size), self.row_arg[f]]
+
+    def set_params(self, subsets):
+        self.subsets = list(subsets)
+        self.slots = dict([(s, i) for i, s in enumerate(self.subsets)])
+
+        # The parameters, one row per subset
+        values = [s.get_param_values() for s in self.subsets]
+        self.params = {}
+        for f in self.families:
+            rows = [numpy.atleast_1d(numpy.array(v[f], dtype=float))
+                    for v in values]
+            # The old euclidean_distance only looked at the common part of
+            # the parameter lists, so we do the same
+            width = min([len(r) for r in rows])
+            self.params[f] = numpy.array([r[:width] for r in rows])
+
+    def fits(self, subsets):
+        """Whether the parameters of these subsets are at least as long as
+        the common part we keep for the others"""
+        for s in subsets:
+            values = s.get_param_values()
+            for f in self.families:
+                if len(numpy.atleast_1d(values[f])) < self.params[f].shape[1]:
+                    return False
+        return True
+
+    def set_param_row(self, slot, s):
+        values = s.get_param_values()
+        for f in self.families:
+            row = numpy.atleast_1d(numpy.array(values[f], dtype=float))
+            self.params[f][slot] = row[:self.params[f].shape[1]]
+
+    def get_distances(self, family, slot, others):
+        diff = self.params[family][others] - self.params[family][slot]
+        return numpy.sqrt((diff ** 2).sum(axis=1))
+
+    def update(self, sch):
+        """Bring the matrix up to date with the subsets in a scheme"""
+        new_subsets = set(sch.subsets)
+        added = [s for s in new_subsets if s not in self.slots]
+        gone = [s for s in self.slots if s not in new_subsets]
+
+        if not self.subsets or len(added) > len(gone):
+            # Can't reuse the slots, so just start again
+            self.build(new_subsets)
+            return
+
+        if not self.fits(added):
+            # A shorter parameter list shrinks the common part for all of
+            # them, so all the distances change
+            self.build(new_subsets)
+            return
+
+        free = []
+        for s in gone:
+            slot = self.slots.pop(s)
+            self.subsets[slot] = None
+            free.append(slot)
+        free.sort()
+
+        for f in self.families:
+            d = self.dists[f]
+            d[free, :] = 0.0
+            d[:, free] = 0.0
+            self.row_max[f][free] = 0.0
+
+            # Only the rows whose biggest distance has gone need looking at
+            lost = numpy.nonzero(numpy.in1d(self.row_arg[f], free))[0]
+            for i in lost:
+                self.row_arg[f][i] = d[i].argmax()
+                self.row_max[f][i] = d[i, self.row_arg[f][i]]
+
+        active = numpy.array([s is not None for s in self.subsets])
+        for s in added:
+            slot = free.pop(0)
+            self.subsets[slot] = s
+            self.slots[s] = slot
+            active[slot] = True
+
+            self.set_param_row(slot, s)
+            for f in self.families:
+                d = self.dists[f]
+                dist = self.get_distances(f, slot, slice(None))
+                dist[~active] = 0.0
+                dist[slot] = 0.0
+                d[slot, :] = dist
+                d[:, slot] = dist
+
+                # Only the new distances can increase the maxima
+                bigger = dist > self.row_max[f]
+                self.row_max[f][bigger] = dist[bigger]
+                self.row_arg[f][bigger] = slot
+                self.row_arg[f][slot] = dist.argmax()
+                self.row_max[f][slot] = dist[self.row_arg[f][slot]]
+
+    def get_final_distances(self):
+        """The weighted distances for every pair of subsets, as two arrays of
+        slots, and one of distances
+        """
+        active = numpy.array(
+            [i for i, s in enumerate(self.subsets) if s is not None])
+        i, j = numpy.triu_indices(len(active), 1)
+        i, j = active[i], active[j]
+
+        total = numpy.zeros(len(i))
+        for f in self.families:
+            max_d = self.row_max[f].max()
+            # Zero-length lists or no variation, this won't contribute
+            if max_d > 0.0:
+                total = total + \
+                    self.dists[f][i, j] * float(self.weights[f]) / float(max_d)
+
+        return i, j, total
+
+    def get_ranked_groupings(self, percent=100.0, limit=None, involves=None):
+        """Return lists of subsets, ordered by the distance between them
+
+        Usually each list is just a pair of subsets, but when pairs are
+        exactly the same distance apart (e.g. when all the weights are zero),
+        we put them all together in one list. We only return the closest
+        percent of the lists, rounded up, and never more than limit of them.
+        If we're given involves, we only look at the pairs where it is true
+        of at least one of the subsets, and take the percent of those.
+        """
+        return list(self.iter_ranked_groupings(percent, limit, involves))
+
+    def iter_ranked_groupings(self, percent=100.0, limit=None, involves=None):
+        """Yield the closest percent of the groupings, closest first
+
+        Only the distances we need are sorted and turned into groupings, so
+        asking for the first few of millions of pairs is cheap.
+        """
+        i, j, total = filter_pairs(
+            self.subsets, involves, *self.get_final_distances())
+        if not len(total):
+            return
+
+        # Each distinct distance is one grouping. The sort is done by numpy,
+        # and it is the only thing here that looks at every pair
+        distinct = numpy.unique(total)
+        cutoff = get_cutoff(len(distinct), percent, limit)
+        if cutoff == 0:
+            return
+        threshold = distinct[cutoff - 1]
+
+        # A stable sort of just the pairs we want keeps the order the same as
+        # sorting all of them
+        wanted = numpy.nonzero(total <= threshold)[0]
+        wanted = wanted[numpy.argsort(total[wanted], kind='mergesort')]
+
+        for group in iter_groupings(
+                self.subsets, i[wanted], j[wanted], total[wanted]):
+            yield group
+
+    def get_closest_grouping(self):
+        """Just the first of the ranked groupings"""
+        i, j, total = self.get_final_distances()
+        closest = numpy.nonzero(total == total.min())[0]
+        group = set()
+        for k in closest:
+            group.add(self.subsets[i[k]])
+            group.add(self.subsets[j[k]])
+        return list(group)
+
+
+class NeighbourIndex(DistanceMatrix):
+    """The closest few subsets to each subset of a scheme
+
+    This gives the same groupings as the DistanceMatrix, but only keeps the k
+    nearest neighbours of each subset, so it doesn't need the (very big) full
+    matrices when there are thousands of subsets. The rankings are exact as
+    long as k is at least the number of groupings asked for: a pair can't be
+    one of the closest m pairs unless each is one of the other's m nearest
+    neighbours.
+
+    The parameter lists can be long (190 model parameters for protein
+    models), which makes KD-trees no better than looking at everything, so we
+    just find the neighbours one row at a time with numpy.
     """
 
-    # Let's make a dict keyed by the distance in the matrix, using setdefault
-    # to add things, in case there are subsets with identical pairwise
-    # distances
-    distances = {}
-    for pair in final_distances:
-        d = final_distances[pair]
-
-        # Get any subs that we already know are that distance apart as a set
-        # default to empty set if it's a new distance
-        subs = distances.setdefault(d, set())
-
-        # Add subs that correspond to this cell
-        subs.add(pair[0])
-        subs.add(pair[1])
-
-    ordered_subsets = []
-    unique_distances = list(distances.keys())
-    unique_distances.sort()
-
-    for d in unique_distances:
-        ordered_subsets.append(list(distances[d]))
-
-    return ordered_subsets
-
-
-def get_pairwise_dists(subsets, rates, freqs, model, alpha, weights):
-
-    import itertools
-    #set up all pairwise combinations as iterators
-    s = itertools.combinations(subsets, 2)
-    r = itertools.combinations(rates, 2)
-    f = itertools.combinations(freqs, 2)
-    m = itertools.combinations(model, 2)
-    a = itertools.combinations(alpha, 2)
-
-    #now we can izip over ALL of them at once (isn't python great!)
-    subset_pairs = []
-    r_dists = []
-    f_dists = []
-    m_dists = []
-    a_dists = []
-
-    for pair in itertools.izip(s, r, f, m, a):
-        subset_pair = pair[0]
-        subset_pairs.append(subset_pair)
-
-        r_dist = euclidean_distance(pair[1][0], pair[1][1])
-        f_dist = euclidean_distance(pair[2][0], pair[2][1])
-        m_dist = euclidean_distance(pair[3][0], pair[3][1])
-        a_dist = euclidean_distance(pair[4][0], pair[4][1])
-
-        r_dists.append(r_dist)
-        f_dists.append(f_dist)
-        m_dists.append(m_dist)
-        a_dists.append(a_dist)
-
-        #print pair
-
-    #and now we get the minmax values
-    max_r = max(r_dists)
-    max_f = max(f_dists)
-    max_m = max(m_dists)
-    max_a = max(a_dists)
-
-    #now we go over them again, and normalise, weight, and sum
-    final_dists = {}
-    closest_pairs = []
-    mindist = None
-    for i, pair in enumerate(itertools.izip(r_dists, f_dists, m_dists, a_dists, subset_pairs)):
-
-        if max_r > 0.0:
-            r_final = pair[0] * float(weights["rate"]) / float(max_r)
+    def __init__(self, weights, k):
+        DistanceMatrix.__init__(self, weights)
+        self.k = k
+
+    def build(self, subsets):
+        self.set_params(subsets)
+
+        size = len(self.subsets)
+        self.active = numpy.ones(size, dtype=bool)
+        self.row_max = {}
+        self.row_arg = {}
+        for f in self.families:
+            self.row_max[f] = numpy.zeros(size)
+            self.row_arg[f] = numpy.zeros(size, dtype=int)
+            for slot in range(size):
+                self.find_row_max(f, slot)
+
+        self.scales = self.get_scales()
+        self.neighbours = numpy.zeros((size, self.k), dtype=int)
+        self.neighbour_dists = numpy.zeros((size, self.k))
+        for slot in range(size):
+            self.find_neighbours(slot)
+
+    def get_row_distances(self, family, slot):
+        dist = self.get_distances(family, slot, slice(None))
+        dist[~self.active] = 0.0
+        dist[slot] = 0.0
+        return dist
+
+    def find_row_max(self, family, slot):
+        dist = self.get_row_distances(family, slot)
+        self.row_arg[family][slot] = dist.argmax()
+        self.row_max[family][slot] = dist[self.row_arg[family][slot]]
+
+    def get_scales(self):
+        scales = []
+        for f in self.families:
+            max_d = self.row_max[f].max()
+            # Zero-length lists or no variation, this won't contribute
+            if max_d > 0.0:
+                scales.append((f, float(self.weights[f]), float(max_d)))
+        return scales
+
+    def get_total_distances(self, slot):
+        # The same sums, in the same order, as get_final_distances
+        total = numpy.zeros(len(self.subsets))
+        for f, weight, max_d in self.scales:
+            total = total + self.get_row_distances(f, slot) * weight / max_d
+        total[~self.active] = numpy.inf
+        total[slot] = numpy.inf
+        return total
+
+    def find_neighbours(self, slot):
+        total = self.get_total_distances(slot)
+        k = min(self.k, self.active.sum() - 1)
+        if k > 0:
+            closest = numpy.argpartition(total, k - 1)[:k]
+            # Break ties by slot, like the full ranking does
+            closest = closest[numpy.lexsort((closest, total[closest]))]
         else:
-            r_final = 0.0
-        if max_f > 0.0:
-            f_final = pair[1] * float(weights["freqs"]) / float(max_f)
+            closest = numpy.zeros(0, dtype=int)
+        self.neighbours[slot] = -1
+        self.neighbour_dists[slot] = numpy.inf
+        self.neighbours[slot, :len(closest)] = closest
+        self.neighbour_dists[slot, :len(closest)] = total[closest]
+
+    def update(self, sch):
+        new_subsets = set(sch.subsets)
+        added = [s for s in new_subsets if s not in self.slots]
+        gone = [s for s in self.slots if s not in new_subsets]
+
+        if not self.subsets or len(added) > len(gone):
+            self.build(new_subsets)
+            return
+        if not added and not gone:
+            return
+
+        free = []
+        for s in gone:
+            slot = self.slots.pop(s)
+            self.subsets[slot] = None
+            self.active[slot] = False
+            free.append(slot)
+        free.sort()
+        changed = list(free)
+
+        for f in self.families:
+            self.row_max[f][free] = 0.0
+            lost = numpy.in1d(self.row_arg[f], free) & self.active
+            lost = numpy.nonzero(lost)[0]
+            for i in lost:
+                self.find_row_max(f, i)
+
+        new_slots = []
+        for s in added:
+            slot = free.pop(0)
+            self.subsets[slot] = s
+            self.slots[s] = slot
+            self.active[slot] = True
+            self.set_param_row(slot, s)
+            new_slots.append(slot)
+
+            for f in self.families:
+                dist = self.get_row_distances(f, slot)
+                bigger = dist > self.row_max[f]
+                self.row_max[f][bigger] = dist[bigger]
+                self.row_arg[f][bigger] = slot
+                self.find_row_max(f, slot)
+
+        scales = self.get_scales()
+        if scales != self.scales:
+            # All the distances have changed
+            self.scales = scales
+            refresh = numpy.nonzero(self.active)[0]
         else:
-            f_final = 0.0
-        if max_m > 0.0:
-            m_final = pair[2] * float(weights["model"]) / float(max_m)
+            # Rows that had a neighbour that has gone
+            refresh = numpy.in1d(self.neighbours, changed).reshape(
+                self.neighbours.shape).any(axis=1)
+            # And rows that the new subsets are closer to than their
+            # furthest neighbour
+            for slot in new_slots:
+                refresh |= self.get_total_distances(slot) < \
+                    self.neighbour_dists[:, -1]
+            refresh[new_slots] = True
+            refresh = numpy.nonzero(refresh & self.active)[0]
+
+        for slot in refresh:
+            self.find_neighbours(slot)
+
+    def get_candidates(self):
+        """The pairs of neighbours, each once, ordered by distance and then
+        slot
+        """
+        active = numpy.nonzero(self.active)[0]
+        i = numpy.repeat(active, self.k)
+        j = self.neighbours[active].ravel()
+        total = self.neighbour_dists[active].ravel()
+        found = j >= 0
+        i, j, total = i[found], j[found], total[found]
+
+        i, j = numpy.minimum(i, j), numpy.maximum(i, j)
+        keys = i * len(self.subsets) + j
+        keys, first = numpy.unique(keys, return_index=True)
+        i, j, total = i[first], j[first], total[first]
+
+        order = numpy.lexsort((j, i, total))
+        return i[order], j[order], total[order]
+
+    def iter_ranked_groupings(self, percent=100.0, limit=None, involves=None):
+        i, j, total = filter_pairs(
+            self.subsets, involves, *self.get_candidates())
+        if not len(total):
+            return
+
+        size = self.active.sum()
+        if self.k >= size - 1:
+            # We have every pair, so we can count the distinct distances
+            count = len(numpy.unique(total))
         else:
-            m_final = 0.0
-        if max_a > 0:
-            a_final = pair[3] * float(weights["alpha"]) / float(max_a)
-        else:
-            a_final = 0.0
-
-        #print i, pair
-
-        total_dist = r_final + f_final + m_final + a_final
-
-        final_dists[pair[4]] = total_dist
-
-        #check to see if this is the closest
-        if (total_dist < mindist or mindist is None):
-            mindist = total_dist
-            closest_pairs = pair[4]  # pair[4] is the tuple of two subsets
-        elif total_dist == mindist:
-            #we want a tuple with all of the subsets that are equally close
-            #with no replicates, so we use tuple(set())
-            closest_pairs = tuple(set(closest_pairs + (pair[4])))
-
-    return final_dists, closest_pairs
-
-def get_distance_matrix(start_scheme, weights):
-    #1. get the parameter lists for each subset
-    subsets = []  # a list of subset names, so we know the order things appear in the list
-    rates = []  # tree length
-    freqs = []  # amino acid or base frequencies
-    model = []  # model parameters e.g. A<->C
-    alpha = [] #alpha parameter of the gamma distribution of rates across sites
-
-    for s in start_scheme.subsets:
-        param_dict = s.get_param_values()
-        subsets.append(s)
-        rates.append([param_dict["rate"]])
-        freqs.append(param_dict["freqs"])
-        model.append(param_dict["model"])
-        alpha.append([param_dict["alpha"]])
-
-    #get pairwise euclidean distances, and minmax values, for all parameters
-    final_dists, closest_pairs = get_pairwise_dists(subsets, rates, freqs, model, alpha, weights)
+            # Assume they're all different
+            count = size * (size - 1) / 2
+            if involves is not None:
+                # Just the pairs with at least one subset we want
+                wanted = len([s for s in self.subsets
+                              if s is not None and involves(s)])
+                count -= (size - wanted) * (size - wanted - 1) / 2
+        cutoff = get_cutoff(count, percent, limit)
+
+        done = 0
+        for group in iter_groupings(self.subsets, i, j, total):
+            if done == cutoff:
+                return
+            yield group
+            done += 1
+
+        if done < cutoff:
+            log.debug("Only found %d of the %d closest groupings, more "
+                      "neighbours would be needed for the rest", done, cutoff)
+
+    def get_closest_grouping(self):
+        i, j, total = self.get_candidates()
+        closest = numpy.nonzero(total == total.min())[0]
+        group = set()
+        for k in closest:
+            group.add(self.subsets[i[k]])
+            group.add(self.subsets[j[k]])
+        return list(group)
+
+
+def get_cutoff(count, percent, limit):
+    """How many of the count groupings we want, rounding up to stop zeros"""
+    cutoff = int(math.ceil(count * percent * 0.01))
+    if limit is not None and cutoff > limit:
+        cutoff = limit
+    return cutoff
+
+
+def filter_pairs(subsets, involves, i, j, total):
+    """Just the pairs of slots where involves is true of one of the subsets"""
+    if involves is None:
+        return i, j, total
+    flagged = numpy.array(
+        [s is not None and bool(involves(s)) for s in subsets])
+    keep = flagged[i] | flagged[j]
+    return i[keep], j[keep], total[keep]
+
+
+def iter_groupings(subsets, i, j, total):
+    """Yield lists of the subsets that are each distance apart, from pairs of
+    slots that are already sorted by distance
+    """
+    group = None
+    last = None
+    for k in range(len(total)):
+        d = total[k]
+        if d != last:
+            if group is not None:
+                yield list(group)
+            group = set()
+            last = d
+        group.add(subsets[i[k]])
+        group.add(subsets[j[k]])
+    if group is not None:
+        yield list(group)
+
+
+def make_distance_index(cfg):
+    """The DistanceMatrix, or a NeighbourIndex if we've been asked to use one
+    """
+    if cfg.cluster_neighbours is None:
+        return DistanceMatrix(cfg.cluster_weights)
+    return NeighbourIndex(cfg.cluster_weights, cfg.cluster_neighbours)
 
-    return final_dists, closest_pairs
 
-def get_closest_subsets(start_scheme, weights):
+def get_closest_subsets(start_scheme, weights, matrix=None):
     """Find the closest subsets in a scheme
     """
-    final_dists, closest_pairs = get_distance_matrix(start_scheme, weights)
-
-    return closest_pairs
+    if matrix is None:
+        matrix = DistanceMatrix(weights)
+    matrix.update(start_scheme)
+    return tuple(matrix.get_closest_grouping())
 
 
-def get_ranked_clustered_subsets(start_scheme, cfg):
+def get_ranked_clustered_subsets(start_scheme, cfg, matrix=None,
+                                 percent=100.0, limit=None, involves=None):
     """
     The idea here is to take a scheme, and perform some analyses to find out
     how the subsets in that scheme cluster.
 
     We then just return the list of schemes, ordered by closest to most distant
-    in the clustering space
+    in the clustering space, cut down to the closest percent of them (and at
+    most limit of them). If we're given the DistanceMatrix from the last step,
+    we only need to work out the distances for the new subsets. With involves,
+    only the lumpings that include a subset it is true of are ranked.
     """
-    final_dists, closest_pairs = get_distance_matrix(
-        start_scheme, cfg.cluster_weights)
-
-    ranked_subset_groupings = get_ranked_list(final_dists)
-    return ranked_subset_groupings
+    if matrix is None:
+        matrix = make_distance_index(cfg)
+    matrix.update(start_scheme)
+    return matrix.get_ranked_groupings(percent, limit, involves)
 
 
 def make_clustered_scheme(start_scheme, scheme_name, subsets_to_cluster, cfg):
@@ -209,7 +525,7 @@ def make_clustered_scheme(start_scheme, scheme_name, subsets_to_cluster, cfg):
     return final_scheme
 
 
-def get_nearest_neighbour_scheme(start_scheme, scheme_name, cfg):
+def get_nearest_neighbour_scheme(start_scheme, scheme_name, cfg, matrix=None):
     """
     The idea here is to take a scheme, and perform some analyses to find a
     neighbouring scheme, where the neighbour has one less subset than the
@@ -221,7 +537,8 @@ def get_nearest_neighbour_scheme(start_scheme, scheme_name, cfg):
     #   be two subsets, but it's generalised so that it could be all of them...
     #   cluster weights is a dictionary of weights, keyed by: rate, freqs, model
     #   for the overall subset rate, the base/aminoacid frequencies, and the model parameters
-    closest_subsets = get_closest_subsets(start_scheme, cfg.cluster_weights)
+    closest_subsets = get_closest_subsets(
+        start_scheme, cfg.cluster_weights, matrix)
 
     scheme = make_clustered_scheme(
         start_scheme, scheme_name, closest_subsets, cfg)
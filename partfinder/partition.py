@@ -18,6 +18,9 @@
 import logging
 log = logging.getLogger("partition")
 
+from hashlib import md5
+
+from columnset import ColumnSet
 from util import PartitionFinderError
 class PartitionError(PartitionFinderError):
     pass
@@ -37,9 +40,16 @@ class PartitionSet(object):
         self.parts_by_number = {}
         self.partitions = set()
 
-        # All of the columns
-        self.columns = []
-        self.columnset = set()
+        # A byte for each column, set once a partition has it. This makes
+        # checking a new partition for overlaps as quick as looking at its
+        # own columns, however many partitions there are already
+        self.used = bytearray()
+
+        # All of the columns, which we only put together when we need them
+        self._columns = None
+
+        # A bit for each partition, so sets of them can be held as integers
+        self.mask = 0
 
         self.finalised = False
 
@@ -56,11 +66,12 @@ class PartitionSet(object):
             log.error("Attempt to add %s when that name already exists", p)
             raise PartitionError
 
-        overlap = []
-        for otherp in self.partitions:
-            if p.columnset & otherp.columnset:
-                overlap.append(str(otherp))
-        if overlap:
+        if self.uses_any(p.columns):
+            # Only now do we need to find out who else has them
+            overlap = []
+            for otherp in self.partitions:
+                if p.columns.overlaps(otherp.columns):
+                    overlap.append(str(otherp))
             log.error("%s overlaps with previously defined "
                       "partitions: %s",
                       p, ", ".join(overlap))
@@ -73,31 +84,63 @@ class PartitionSet(object):
         self.parts_by_name[p.name] = p
         self.parts_by_number[self.sequence] = p
         p.sequence = self.sequence
+        p.mask = 1 << p.sequence
         self.sequence += 1
         self.partitions.add(p)
-
-        # Merge all the columns
-        self.columns.extend(p.columns)
-        self.columns.sort()
-        self.columnset |= p.columnset
+        self.mask |= p.mask
+
+        self.use(p.columns)
+        self._columns = None
+
+    def uses_any(self, columns):
+        """Whether any of the columns already belong to a partition"""
+        for start, stop, step in columns.runs:
+            if '\x01' in self.used[start:stop:step]:
+                return True
+        return False
+
+    def use(self, columns):
+        if columns and columns.last() >= len(self.used):
+            self.used.extend('\x00' * (columns.last() + 1 - len(self.used)))
+        for start, stop, step in columns.runs:
+            self.used[start:stop:step] = '\x01' * len(xrange(start, stop, step))
+
+    def make_columns(self):
+        self._columns = ColumnSet().union(
+            *[p.columns for p in self.partitions])
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self.make_columns()
+        return self._columns
 
     def finalise(self):
         """Ensure that no more partitions can be added"""
         self.finalised = True
+        # Nothing can change them now, so put the columns together for good
+        self.make_columns()
+
+    def make_digests(self, alignment):
+        """Work out a digest of the sites in each partition, so that we can
+        tell whether results stored for them in an earlier analysis are still
+        good"""
+        names = sorted(alignment.names)
+        for p in self.partitions:
+            p.make_digest(alignment, names)
 
     def check_against_alignment(self, alignment):
         """Check the partition definitions against the alignment"""
 
         # TODO: pbly should check the converse too -- stuff defined that is
         # missing??
-        self.fullset = set(range(0, alignment.sequence_len))
-        leftout = self.fullset - self.columnset
+        leftout = self.columns.missing(alignment.sequence_len)
         if leftout:
             # This does not raise an error, just a warning
             log.warn(
                 "Columns defined in partitions range from %s to %s, "
                 "but these columns in the alignment are missing: %s", 
-                self.columns[0]+1, self.columns[-1]+1,
+                self.columns.first()+1, self.columns.last()+1,
                 columnset_to_string(leftout))
         
     # We can treat this like a bit like a dictionary
@@ -118,6 +161,11 @@ class PartitionSet(object):
     def names(self):
         return self.parts_by_name.keys()
 
+    def from_mask(self, mask):
+        """The partitions whose bits are set in a mask"""
+        return [p for i, p in sorted(self.parts_by_number.items())
+                if mask & (1 << i)]
+
 class Partition(object):
     """A set of columns from an alignment"""
     def __init__(self, cfg, name=None, *partlist):
@@ -127,15 +175,19 @@ class Partition(object):
         self.name = name
         description = []
 
-        # This will get set later, when they are added to PartitionSet
+        # These will get set later, when they are added to PartitionSet
         self.partition_set = None
+        self.mask = 0
+
+        # And this once we have the alignment
+        self.digest = None
 
         # We now need to convert to column definitions. Note that these are
         # zero based, which is not how they are specified in the config. So we
         # must do some fiddling to make sure they are right. In addition, we
         # use range(...) which excludes the final column, whereas the
         # definitions assume inclusive...
-        columns = []
+        ranges = []
         for p in partlist:
 
             # Make sure it is sensible
@@ -155,27 +207,42 @@ class Partition(object):
                 raise PartitionError
 
             # Actually, subtracting 1 deals with both issues...
-            columns.extend(range(start-1, stop, step))
+            ranges.append((start-1, stop, step))
             description.append((start, stop, step))
 
         self.description = tuple(description)
 
-        # Normalise it all
-        columns.sort()
-        columnset = set(columns)
-
-        # If there was any overlap then these will differ...
-        if len(columns) != len(columnset):
-            log.error("Partition '%s' has internal overlap", name)
-            raise PartitionError
+        # Check the ranges against each other
+        columns = []
+        for r in ranges:
+            run = ColumnSet.from_ranges([r])
+            for other in columns:
+                if run.overlaps(other):
+                    log.error("Partition '%s' has internal overlap", name)
+                    raise PartitionError
+            columns.append(run)
 
-        # Both of these are useful?
-        self.columns = columns
-        self.columnset = columnset
+        self.columns = ColumnSet().union(*columns)
 
         cfg.partitions.add_partition(self)
         log.debug("Created %s", self)
 
+    def make_digest(self, alignment, names):
+        # The columns in the order they were described, so the digests match
+        # the ones from earlier analyses
+        columns = []
+        for start, stop, step in self.description:
+            columns.extend(range(start-1, stop, step))
+        block = alignment.get_block(columns)
+
+        d = md5()
+        for nm in names:
+            d.update(nm)
+            d.update('\0')
+            d.update(block[nm])
+            d.update('\0')
+        self.digest = d.hexdigest()
+
     def __repr__(self):
         outlist = ", ".join(["%s-%s\\%s" % tuple(p) for p in self.description])
         return "Partition<%s: %s>" % (self.name, outlist)
@@ -150,17 +150,27 @@ def make_branch_lengths(alignment_path, topology_path, datatype, cmdline_extras)
     return tree_path
 
 
-def check_defaults(cmdline_extras):
+# The lnL precision we use for a full analysis, and for screening models
+_accuracy = 0.01
+_screen_accuracy = 0.1
+
+
+def check_defaults(cmdline_extras, screen=False):
     """We use some sensible defaults, but allow users to override them with extra cmdline options"""
 
+    if screen:
+        accuracy = _screen_accuracy
+    else:
+        accuracy = _accuracy
+
     if cmdline_extras.count("--min_diff_lk_global") > 0:
         accuracy_global = ""
     else:
-        accuracy_global = " --min_diff_lk_global 0.01 "
+        accuracy_global = " --min_diff_lk_global %s " % accuracy
     if cmdline_extras.count("--min_diff_lk_local") > 0:
         accuracy_local = ""
     else:
-        accuracy_local = " --min_diff_lk_local 0.01 "
+        accuracy_local = " --min_diff_lk_local %s " % accuracy
 
     #we'll put spaces at the start and end too, just in case...
     cmdline_extras = ''.join(
@@ -169,8 +179,18 @@ def check_defaults(cmdline_extras):
     return cmdline_extras
 
 
-def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
-    """Do the analysis -- this will overwrite stuff!"""
+def get_result_options(cmdline_extras):
+    """The extra options that can change the results, which is all of them"""
+    return " ".join(cmdline_extras.split())
+
+
+def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras,
+            screen=False):
+    """Do the analysis -- this will overwrite stuff!
+
+    If screen is set, the likelihood is only optimised roughly, and the
+    output goes to separate files
+    """
 
     # Move it to a new name to stop phyml stomping on different model analyses
     # dupfile(alignment_path, analysis_path)
@@ -187,10 +207,11 @@ def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
         log.error("Unknown option for branchlengths: %s", branchlengths)
         raise PhymlError
 
-    cmdline_extras = check_defaults(cmdline_extras)
+    cmdline_extras = check_defaults(cmdline_extras, screen)
 
     command = "--run_id %s -b 0 -i '%s' -u '%s' %s %s %s " % (
-        model, alignment_path, tree_path, model_params, bl, cmdline_extras)
+        make_run_id(model, screen), alignment_path, tree_path, model_params,
+        bl, cmdline_extras)
     run_phyml(command)
 
     # Now get rid of this -- we have the original elsewhere
@@ -202,28 +223,36 @@ def make_tree_path(alignment_path):
     return pth + ".phy_phyml_tree.txt"
 
 
-def make_output_path(aln_path, model):
+def make_run_id(model, screen=False):
+    if screen:
+        return "%s_screen" % model
+    return model
+
+
+def make_output_path(aln_path, model, screen=False):
     # analyse_path = os.path.join(root_path, name + ".phy")
     pth, ext = os.path.splitext(aln_path)
-    stats_path = "%s.phy_phyml_stats_%s.txt" % (pth, model)
-    tree_path = "%s.phy_phyml_tree_%s.txt" % (pth, model)
+    run_id = make_run_id(model, screen)
+    stats_path = "%s.phy_phyml_stats_%s.txt" % (pth, run_id)
+    tree_path = "%s.phy_phyml_tree_%s.txt" % (pth, run_id)
     return stats_path, tree_path
 
 
-def remove_files(aln_path, model):
+def remove_files(aln_path, model, screen=False):
     '''remove all files from the alignment directory that are produced by phyml'''
-    fnames = make_output_path(aln_path, model)
+    fnames = make_output_path(aln_path, model, screen)
     util.delete_files(fnames)
 
 
-class PhymlResult(object):
+class PhymlResult(util.ModelResult):
+    # We don't read the rates, freqs or alpha from phyml, so these are the
+    # empty ones that ModelResult has
+    __slots__ = ()
+
     def __init__(self, lnl, tree_size, seconds):
         self.lnl = lnl
         self.seconds = seconds
         self.tree_size = tree_size
-        self.rates = {} #placeholder, doesn't do anything but makes it compatible
-        self.freqs = {} #placeholder, doesn't do anything but makes it compatible
-        self.alpha = 0  #placeholder, doesn't do anything but makes it compatible
 
     def __str__(self):
         return "PhymlResult(lnl:%s, tree_size:%s, secs:%s)" % (self.lnl, self.tree_size, self.seconds)
@@ -26,6 +26,7 @@ import os
 import shutil
 import sys
 import fnmatch
+from array import array
 import util
 
 from pyparsing import (
@@ -164,14 +165,22 @@ def make_branch_lengths(alignment_path, topology_path, datatype, cmdline_extras)
     return tree_path
 
 
-def check_defaults(cmdline_extras):
+# The lnL precision we use for a full analysis, and for screening models
+_accuracy = 1.0
+_screen_accuracy = 10.0
+
+
+def check_defaults(cmdline_extras, screen=False):
     """We use some sensible defaults, but allow users to override them with extra cmdline options"""
     if cmdline_extras.count("-e") > 0:
         #then the user has specified a particular accuracy:
         accuracy = ""
+    elif screen:
+        #screening only needs a rough idea of the lnL
+        accuracy = " -e %s " % _screen_accuracy
     else:
         #we specify a default accuracy of 1 lnL unit
-        accuracy = " -e 1.0 "
+        accuracy = " -e %s " % _accuracy
 
     #we set this in case people are using the PThreads version of RAxML
     #note that this is intentionally set to give an error if people use Pthreads, because
@@ -192,8 +201,28 @@ def check_defaults(cmdline_extras):
     return cmdline_extras
 
 
-def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
-    """Do the analysis -- this will overwrite stuff!"""
+def get_result_options(cmdline_extras):
+    """The extra options that can change the results. The number of threads
+    only changes how quickly we get them."""
+    options = []
+    skip = False
+    for opt in cmdline_extras.split():
+        if skip:
+            skip = False
+        elif opt == "-T":
+            skip = True
+        elif not opt.startswith("-T"):
+            options.append(opt)
+    return " ".join(options)
+
+
+def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras,
+            screen=False):
+    """Do the analysis -- this will overwrite stuff!
+
+    If screen is set, the likelihood is only optimised roughly, and the
+    output goes to separate files
+    """
 
     # Move it to a new name to stop raxml stomping on different model analyses
     # dupfile(alignment_path, analysis_path)
@@ -210,10 +239,10 @@ def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
         log.error("Unknown option for branchlengths: %s", branchlengths)
         raise RaxmlError
 
-    cmdline_extras = check_defaults(cmdline_extras)
+    cmdline_extras = check_defaults(cmdline_extras, screen)
 
     #raxml doesn't append alignment names automatically, like PhyML, let's do that here
-    analysis_ID = raxml_analysis_ID(alignment_path, model)
+    analysis_ID = raxml_analysis_ID(alignment_path, model, screen)
 
     #force raxml to write to the dir with the alignment in it
     #-e 1.0 sets the precision to 1 lnL unit. This is all that's required here, and helps with speed.
@@ -223,10 +252,13 @@ def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
     run_raxml(command)
 
 
-def raxml_analysis_ID(alignment_path, model):
+def raxml_analysis_ID(alignment_path, model, screen=False):
     dir, file = os.path.split(alignment_path)
     aln_name = os.path.splitext(file)[0]
-    analysis_ID = '%s_%s.txt' % (aln_name, model)
+    if screen:
+        analysis_ID = '%s_%s_screen.txt' % (aln_name, model)
+    else:
+        analysis_ID = '%s_%s.txt' % (aln_name, model)
     return analysis_ID
 
 
@@ -236,8 +268,8 @@ def make_tree_path(alignment_path):
     return tree_path
 
 
-def make_output_path(alignment_path, model):
-    analysis_ID = raxml_analysis_ID(alignment_path, model)
+def make_output_path(alignment_path, model, screen=False):
+    analysis_ID = raxml_analysis_ID(alignment_path, model, screen)
     dir, aln_file = os.path.split(alignment_path)
     stats_fname = "RAxML_info.%s" % (analysis_ID)
     stats_path = os.path.join(dir, stats_fname)
@@ -246,21 +278,33 @@ def make_output_path(alignment_path, model):
     return stats_path, tree_path
 
 
-def remove_files(aln_path, model):
+def remove_files(aln_path, model, screen=False):
     '''remove all files from the alignment directory that are produced by raxml'''
     dir, file = os.path.split(aln_path)
-    analysis_ID = raxml_analysis_ID(aln_path, model)
+    analysis_ID = raxml_analysis_ID(aln_path, model, screen)
     dir = os.path.abspath(dir)
     fs = os.listdir(dir)
     fnames = fnmatch.filter(fs, '*%s*' % analysis_ID)
     util.delete_files(fnames)
 
 
-class RaxmlResult(object):
+def get_ordered_values(values):
+    """The values of a dict, as an array in the order of their keys"""
+    return array('d', [values[k] for k in sorted(values)])
 
-    def __init__(self):
-        self.rates = {}
-        self.freqs = {}
+
+class RaxmlResult(util.ModelResult):
+    # The rates and freqs are arrays, in the order of the letters (or pairs
+    # of letters) they belong to
+    __slots__ = ('alpha', 'rates', 'freqs')
+
+    def __setstate__(self, state):
+        util.ModelResult.__setstate__(self, state)
+        # Older results kept these as dicts
+        if isinstance(self.rates, dict):
+            self.rates = get_ordered_values(self.rates)
+        if isinstance(self.freqs, dict):
+            self.freqs = get_ordered_values(self.freqs)
 
     def __str__(self):
         return "RaxmlResult(lnl:%s, tree_size:%s, secs:%s, alphs:%s)" % (
@@ -328,21 +372,26 @@ class Parser(object):
 
     def set_rate(self, tokens):
         basefrom, baseto, rate = tokens
-        self.result.rates[(basefrom, baseto)] = rate
+        self.rates[(basefrom, baseto)] = rate
 
     def set_freq(self, tokens):
         base, rate = tokens
-        self.result.freqs[base] = rate
+        self.freqs[base] = rate
 
     def parse(self, text):
         log.debug("Parsing raxml output...")
         self.result = RaxmlResult()
+        self.rates = {}
+        self.freqs = {}
         try:
             self.root_parser.parseString(text)
         except ParseException, p:
             log.error(str(p))
             raise RaxmlError
 
+        self.result.rates = get_ordered_values(self.rates)
+        self.result.freqs = get_ordered_values(self.freqs)
+
         log.debug("Result is %s", self.result)
         return self.result
 
@@ -23,6 +23,7 @@ import os
 scheme_header_template = "%-18s: %s\n"
 scheme_subset_template = "%-6s | %-10s | %-30s | %-30s | %-40s\n"
 subset_template = "%-15s | %-15s | %-15s | %-15s | %-15s\n"
+sweep_template = "%-40s | %-15s | %-15s | %-15s | %-8s\n"
 
 
 class TextReporter(object):
@@ -45,6 +46,11 @@ class TextReporter(object):
         output.write(subset_template % ("Model", "lNL", "AIC", "AICc", "BIC"))
         for bic, r in model_results:
             output.write(subset_template % (r.model, r.lnl, r.aic, r.aicc, r.bic))
+        if sub.pruned_models:
+            output.write("\nThese models were not fully analysed, as they "
+                         "could not be selected under the %s: %s\n" %
+                         (self.cfg.model_selection.upper(),
+                          ", ".join(sorted(sub.pruned_models))))
 
     def write_scheme_summary(self, sch, result):
         pth = os.path.join(self.cfg.schemes_path, sch.name + '.txt')
@@ -54,7 +60,7 @@ class TextReporter(object):
     def output_scheme(self, sch, result, output):
         self.write_scheme_header(sch, result, output)
         sorted_subsets = [sub for sub in sch]
-        sorted_subsets.sort(key=lambda sub: min(sub.columns), reverse=False)
+        sorted_subsets.sort(key=lambda sub: sub.columns.first(), reverse=False)
         self.write_subsets(sch, result, output, sorted_subsets)
         self.write_raxml(sch, result, output, sorted_subsets)
 
@@ -156,7 +162,11 @@ class TextReporter(object):
             number += 1
 
     def write_best_scheme(self, result):
-        pth = os.path.join(self.cfg.output_path, 'best_scheme.txt')
+        if self.cfg.sweep_name is None:
+            name = 'best_scheme.txt'
+        else:
+            name = 'best_scheme_%s.txt' % self.cfg.sweep_name
+        pth = os.path.join(self.cfg.output_path, name)
         output = open(pth, 'wb')
         output.write('Settings used\n\n')
         output.write(scheme_header_template % ("alignment", self.cfg.alignment_path))
@@ -165,6 +175,9 @@ class TextReporter(object):
         output.write(scheme_header_template % ("model_selection",
                                                 self.cfg.model_selection))
         output.write(scheme_header_template % ("search", self.cfg.search))
+        if self.cfg.start_scheme is not None:
+            output.write(scheme_header_template % ("start-scheme",
+                                                   self.cfg.start_scheme))
         if self.cfg.search in ["rcluster", "hcluster"]:
             pretty_weights = "rate = %s, base = %s, model = %s, alpha = %s" %(
                                str(self.cfg.cluster_weights["rate"]),
@@ -178,3 +191,15 @@ class TextReporter(object):
         output.write('\n\nBest partitioning scheme\n\n')        
         self.output_scheme(result.best_scheme, result.best_result, output)
         log.info("Information on best scheme is here: %s", pth)
+
+    def write_sweep_summary(self, sweep_results):
+        """One line for the best scheme found with each of the settings"""
+        pth = os.path.join(self.cfg.output_path, 'sweep_summary.txt')
+        output = open(pth, 'w')
+        output.write(sweep_template % (
+            "Settings", "Best scheme", "lnL", "Score", "Subsets"))
+        for name, result in sweep_results:
+            output.write(sweep_template % (
+                name, result.best_scheme.name, result.best_result.lnl,
+                result.best_score, result.best_result.nsubs))
+        log.info("Summary of the sweep is here: %s", pth)
@@ -17,6 +17,7 @@
 
 import logging
 log = logging.getLogger("scheme")
+import re
 import subset
 import submodels
 
@@ -30,6 +31,9 @@ class SchemeError(PartitionFinderError):
 
 
 class SchemeResult(object):
+    __slots__ = ('scheme_name', 'scheme', 'model_selection', 'nsubs',
+                 'sum_k', 'lnl', 'nsites', 'aic', 'bic', 'aicc')
+
     def __init__(self, sch, nseq, branchlengths, model_selection):
         self.scheme_name = sch.name
         self.scheme = sch
@@ -64,7 +68,7 @@ class SchemeResult(object):
         log.debug("Grand total parameters: %d" % (self.sum_k))
 
         self.lnl = sum([s.best_lnl for s in sch])
-        self.nsites = sum([len(s.columnset) for s in sch])
+        self.nsites = sum([len(s.columns) for s in sch])
 
         K = float(self.sum_k)
         n = float(self.nsites)
@@ -97,45 +101,41 @@ class SchemeResult(object):
 
 
 class Scheme(object):
+    __slots__ = ('name', 'subsets', 'description', 'part_subsets')
+
     def __init__(self, cfg, name, subsets, description=None):
         """A set of subsets of partitions"""
         self.name = name
         self.subsets = set()
         self.description = description
 
-        # This one is a set of frozensets of partitions...
-        part_subsets = set()
-
-        # This is really long-winded, but it is mainly for error-checking
-        partitions = set()
-        duplicates = []
+        # Each subset is an integer with a bit set for each of its
+        # partitions, so the checking is one operation per subset
+        pset = cfg.partitions
+        partitions = 0
+        duplicates = 0
         for s in subsets:
-            for p in s:
-                if p in partitions:
-                    # This is an error -- we'll collect them up
-                    duplicates.append(str(p))
-                else:
-                    partitions.add(p)
+            # Any bits we've already seen are errors -- we'll collect them up
+            duplicates |= partitions & s.mask
+            partitions |= s.mask
             self.subsets.add(s)
-            part_subsets.add(s.partitions)
 
-        self.part_subsets = frozenset(part_subsets)
+        # The subsets, in a form that is quick to compare
+        self.part_subsets = tuple(sorted([s.mask for s in self.subsets]))
 
         # Report the errors
         if duplicates:
             log.error("Scheme '%s' contains duplicate partitions: %s",
-                      name, ', '.join(duplicates))
+                      name, ', '.join(
+                          [str(p) for p in pset.from_mask(duplicates)]))
             raise SchemeError
 
-        # Hm. It seems this is the only way to get just one item out of a set
-        # as pop would remove one...
-        pset = cfg.partitions
-
-        # Do a set-difference to see what is missing...
-        missing = pset.partitions - partitions
+        # Anything not covered is missing...
+        missing = pset.mask & ~partitions
         if missing:
             log.error("Scheme '%s' is missing partitions: %s",
-                      name, ', '.join([str(p) for p in missing]))
+                      name, ', '.join(
+                          [str(p) for p in pset.from_mask(missing)]))
             raise SchemeError
 
         # This locks down whether new partitions can be created.
@@ -218,6 +218,67 @@ def create_scheme(cfg, scheme_name, scheme_description):
     return Scheme(cfg, str(scheme_name), created_subsets, description=scheme_description)
 
 
+def get_scheme_description(cfg, sch):
+    """The opposite of create_scheme: turn a scheme into a list of numbers,
+    one for each partition, that say which subset the partition is in.
+
+    The description is kept on the scheme, as working it out is slow with
+    lots of partitions.
+    """
+    if sch.description is not None:
+        return sch.description
+    subset_numbers = {}
+    description = []
+    for i in range(len(cfg.partitions)):
+        part = cfg.partitions[i]
+        for sub in sch.subsets:
+            if sub.mask & part.mask:
+                break
+        description.append(subset_numbers.setdefault(sub, len(subset_numbers)))
+    sch.description = description
+    return description
+
+
+def parse_scheme_description(cfg, scheme_name, text, complete=False):
+    """Create a scheme from the description we write at the end of each
+    scheme file, e.g. "Scheme_step_2 = (COI_1, EF1a_2) (COI_3) (EF1a_1);"
+
+    With complete set, data blocks that no longer exist are left out, and
+    data blocks that aren't in the description get their own subsets.
+    """
+    found = re.search(r"=\s*((\([^()]*\)\s*)+);", text)
+    if found is None:
+        log.error("Couldn't find a description of a scheme in "
+                  "PartitionFinder format")
+        raise SchemeError
+
+    created_subsets = []
+    described = set()
+    for names in re.findall(r"\(([^()]*)\)", found.group(1)):
+        parts = []
+        for nm in names.split(","):
+            nm = nm.strip()
+            if nm not in cfg.partitions:
+                if complete:
+                    log.info("Leaving out data block '%s', which is no "
+                             "longer defined", nm)
+                    continue
+                log.error("The data block '%s' in scheme %s is not defined in "
+                          "the [data_blocks]", nm, scheme_name)
+                raise SchemeError
+            parts.append(cfg.partitions[nm])
+        if parts:
+            created_subsets.append(subset.Subset(*tuple(parts)))
+            described.update(parts)
+
+    if complete:
+        for part in cfg.partitions:
+            if part not in described:
+                created_subsets.append(subset.Subset(part))
+
+    return Scheme(cfg, str(scheme_name), created_subsets)
+
+
 def model_to_scheme(model, scheme_name, cfg):
     """Turn a model definition e.g. [0, 1, 2, 3, 4] into a scheme"""
     subs = {}
@@ -0,0 +1,264 @@
+#Copyright (C) 2012 Robert Lanfear and Brett Calcott
+#
+#This program is free software: you can redistribute it and/or modify it
+#under the terms of the GNU General Public License as published by the
+#Free Software Foundation, either version 3 of the License, or (at your
+#option) any later version.
+#
+#This program is distributed in the hope that it will be useful, but
+#WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#General Public License for more details. You should have received a copy
+#of the GNU General Public License along with this program.  If not, see
+#<http://www.gnu.org/licenses/>. PartitionFinder also includes the PhyML
+#program, the RAxML program, the PyParsing library, and the python-cluster library
+#all of which are protected by their own licenses and conditions, using
+#PartitionFinder implies that you agree with those licences and conditions as well.
+
+"""The results of every subset, in one SQLite database
+
+There is a row for each subset, and a row for each model result of each
+subset, all keyed by the name the subset is cached under (see
+Subset.get_cache_name). Writes are collected up and done in one
+transaction at the end of each batch of subsets, and the results for a
+batch are read in with a few queries, rather than a file per subset.
+
+Earlier versions kept a .bin file for each subset. When the store doesn't
+have a subset, we look for its .bin file, and copy what we find into the
+store. The oldest of them are named after the data blocks in the subset,
+not the settings, so we only use those if the analysis they came from was
+set up the same way as this one.
+"""
+
+import logging
+log = logging.getLogger("store")
+
+import os
+import fnmatch
+import sqlite3
+import threading
+import cPickle as pickle
+
+from util import PartitionFinderError
+
+
+class StoreError(PartitionFinderError):
+    pass
+
+
+STORE_NAME = 'results.db'
+
+# SQLite won't take too many parameters in one statement
+MAX_PARAMS = 500
+
+_schema = """
+CREATE TABLE IF NOT EXISTS subsets (
+    name TEXT PRIMARY KEY,
+    alignment_path TEXT,
+    pruned_models BLOB
+);
+CREATE TABLE IF NOT EXISTS results (
+    name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    screen INTEGER NOT NULL,
+    result BLOB NOT NULL,
+    PRIMARY KEY (name, model, screen)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def dumps(obj):
+    return sqlite3.Binary(pickle.dumps(obj, -1))
+
+
+def loads(blob):
+    return pickle.loads(str(blob))
+
+
+def copy_fields(fields):
+    """A copy the subset can change without changing what we hold"""
+    copy = {}
+    for k, v in fields.items():
+        if isinstance(v, dict):
+            v = dict(v)
+        copy[k] = v
+    return copy
+
+
+class ResultStore(object):
+    def __init__(self, path):
+        self.path = path
+
+        # The analysis threads finalise subsets, so everything goes through
+        # this
+        self.lock = threading.Lock()
+
+        # Subsets waiting to be written, and ones read in ahead of time
+        self.pending = {}
+        self.loaded = {}
+
+        # Only look for the old .bin files if there were any to start with
+        folder = os.path.dirname(path) or '.'
+        self.old_pickles = bool(fnmatch.filter(os.listdir(folder), '*.bin'))
+        # And only for the oldest ones if they are from these settings
+        self.old_names = False
+
+        try:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # Readers don't block the writer (or each other) in WAL mode
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(_schema)
+        except sqlite3.Error, e:
+            log.error("Failed to open the results store '%s': %s", path, e)
+            raise StoreError
+
+    def check_old_names(self, digest, same_settings):
+        """Work out if the oldest .bin files belong to this analysis
+
+        They were made with the settings of the analysis that was run before
+        this store was, so the first time we see them, we record the digest
+        of the settings if they haven't changed since then. After that, they
+        are only used with the same settings.
+        """
+        if not self.old_pickles:
+            return
+        row = self.db.execute(
+            "SELECT value FROM settings WHERE key = 'old_names'").fetchone()
+        if row is None:
+            old_digest = digest if same_settings else ''
+            try:
+                with self.db:
+                    self.db.execute(
+                        "INSERT INTO settings VALUES ('old_names', ?)",
+                        (old_digest,))
+            except sqlite3.Error, e:
+                log.error("Failed to write to the results store '%s': %s",
+                          self.path, e)
+                raise StoreError
+            if not same_settings:
+                log.warning("The settings have changed since the analysis "
+                            "that made the oldest results in '%s', so they "
+                            "won't be used", os.path.dirname(self.path))
+        else:
+            old_digest = row[0]
+        self.old_names = old_digest == digest
+
+    def save(self, name, fields):
+        """Keep the fields of a subset, to write with the next flush"""
+        self.lock.acquire()
+        try:
+            self.pending[name] = copy_fields(fields)
+            self.loaded.pop(name, None)
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """Write everything saved since the last flush in one transaction"""
+        self.lock.acquire()
+        try:
+            if not self.pending:
+                return
+            log.debug("Writing %d subsets to the results store",
+                      len(self.pending))
+            subset_rows = []
+            result_rows = []
+            for name, fields in self.pending.items():
+                # The oldest .bin files don't have all of these
+                subset_rows.append((name, fields.get('alignment_path'),
+                                    dumps(fields.get('pruned_models', {}))))
+                for screen, key in ((0, 'results'), (1, 'screen_results')):
+                    for model, result in fields.get(key, {}).items():
+                        result_rows.append((name, model, screen, dumps(result)))
+
+            try:
+                # This commits, or rolls back if anything goes wrong
+                with self.db:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO subsets VALUES (?, ?, ?)",
+                        subset_rows)
+                    self.db.executemany(
+                        "DELETE FROM results WHERE name = ?",
+                        [(r[0],) for r in subset_rows])
+                    self.db.executemany(
+                        "INSERT INTO results VALUES (?, ?, ?, ?)",
+                        result_rows)
+            except sqlite3.Error, e:
+                log.error("Failed to write to the results store '%s': %s",
+                          self.path, e)
+                raise StoreError
+            self.pending.clear()
+        finally:
+            self.lock.release()
+
+    def read(self, names):
+        """Read the fields of the subsets with these names from the db"""
+        found = {}
+        for i in range(0, len(names), MAX_PARAMS):
+            chunk = names[i:i + MAX_PARAMS]
+            marks = ", ".join(["?"] * len(chunk))
+            for name, path, pruned in self.db.execute(
+                    "SELECT name, alignment_path, pruned_models FROM subsets "
+                    "WHERE name IN (%s)" % marks, chunk):
+                found[name] = {
+                    'alignment_path': path,
+                    'pruned_models': loads(pruned),
+                    'results': {},
+                    'screen_results': {},
+                }
+            for name, model, screen, result in self.db.execute(
+                    "SELECT name, model, screen, result FROM results "
+                    "WHERE name IN (%s)" % marks, chunk):
+                key = 'screen_results' if screen else 'results'
+                found[name][key][model] = loads(result)
+        return found
+
+    def load_many(self, names):
+        """Read in the subsets we're about to need, all at once"""
+        self.lock.acquire()
+        try:
+            names = [nm for nm in set(names)
+                     if nm not in self.pending and nm not in self.loaded]
+            found = self.read(names)
+            # Remember the ones we don't have too, so we don't look again
+            for nm in names:
+                self.loaded[nm] = found.get(nm, None)
+        finally:
+            self.lock.release()
+
+    def load(self, name):
+        """The fields of a subset, or None if we don't have them"""
+        self.lock.acquire()
+        try:
+            if name in self.pending:
+                return copy_fields(self.pending[name])
+            if name in self.loaded:
+                return self.loaded.pop(name)
+            return self.read([name]).get(name, None)
+        finally:
+            self.lock.release()
+
+    def forget(self):
+        """Drop anything we read in ahead, but didn't need after all"""
+        self.lock.acquire()
+        try:
+            self.loaded.clear()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def read_pickle(pth):
+    """The fields of a subset from one of the old .bin files"""
+    f = open(pth, 'rb')
+    try:
+        return pickle.load(f)
+    finally:
+        f.close()
@@ -58,11 +58,20 @@ def submodel_iterator(pat, current, maxn):
 def a_choose_b(n,k):
     return reduce(lambda a,b: a*(n-b)/(b+1),xrange(k),1)
 
-def count_relaxed_clustering_subsets(N, cluster_percent, output=False):
+def count_relaxed_clustering_step(N, cluster_percent, max_schemes=None):
+    """The number of schemes in one step of the relaxed clustering, with N
+    subsets in the starting scheme"""
+    count = int(math.ceil(a_choose_b(N, 2)*cluster_percent*0.01))
+    if max_schemes is not None and count > max_schemes:
+        count = max_schemes
+    return count
+
+def count_relaxed_clustering_subsets(N, cluster_percent, output=False,
+                                     max_schemes=None):
     #startscheme    
     start_scheme = N
     #firstbatch is just cluster_percent of N choose 2
-    step_1 = int(math.ceil(a_choose_b(N, 2)*cluster_percent*0.01))
+    step_1 = count_relaxed_clustering_step(N, cluster_percent, max_schemes)
     previous = step_1
     cumsum = start_scheme+step_1
     if output: print start_scheme
@@ -72,7 +81,8 @@ def count_relaxed_clustering_subsets(N, cluster_percent, output=False):
         # once we get to the all combined scheme we can stop  
         if i == 1:
             break
-        num_new_schemes = int(math.ceil((a_choose_b(i, 2))*cluster_percent*0.01))
+        num_new_schemes = count_relaxed_clustering_step(
+            i, cluster_percent, max_schemes)
         # but those new schemes include a lot we will have already analysed
         # so we want to subtract that many. We could have already seen up to i-1 choose 2
         # the worst case is that the scheme we chose knocked out the maximum number of 
@@ -88,11 +98,12 @@ def count_relaxed_clustering_subsets(N, cluster_percent, output=False):
         if output:print cumsum
     return cumsum
 
-def count_relaxed_clustering_schemes(N, cluster_percent, output=False):
+def count_relaxed_clustering_schemes(N, cluster_percent, output=False,
+                                     max_schemes=None):
     #startscheme    
     start_scheme = 1
     #firstbatch is just cluster_percent of N choose 2
-    step_1 = int(math.ceil(a_choose_b(N, 2)*cluster_percent*0.01))
+    step_1 = count_relaxed_clustering_step(N, cluster_percent, max_schemes)
     previous = step_1
     cumsum = start_scheme+step_1
     if output: print start_scheme
@@ -102,7 +113,8 @@ def count_relaxed_clustering_schemes(N, cluster_percent, output=False):
         # each subsequent step is cluster_percent of i choose 2  
         if i == 1:
             break
-        num_new_schemes = int(math.ceil((a_choose_b(i, 2))*cluster_percent*0.01))
+        num_new_schemes = count_relaxed_clustering_step(
+            i, cluster_percent, max_schemes)
         cumsum += num_new_schemes
         if output:print cumsum
     return cumsum
@@ -19,15 +19,17 @@ import logging
 log = logging.getLogger("subset")
 import os
 import weakref
+import random
 
+from collections import OrderedDict
 from hashlib import md5
 
 # import base64
 # from zlib import compress
 
-import cPickle as pickle
-from math import log as logarithm
-from alignment import Alignment, SubsetAlignment
+from math import log as logarithm, ceil
+from columnset import ColumnSet
+import store
 from util import PartitionFinderError, remove_runID_files
 
 FRESH, PREPARED, DONE = range(3)
@@ -44,8 +46,100 @@ def count_subsets():
 
 
 def clear_subsets():
-    pass
-    # Subset._cache.clear()
+    recent_subsets.clear()
+
+
+# How many subsets we hold on to once nothing else is using them
+DEFAULT_CACHE_SIZE = 5000
+
+
+class RecentSubsets(object):
+    """The most recently used subsets, up to a limit
+
+    Subset._cache only holds weak references, so a subset goes as soon as
+    nothing else refers to it, and its results then have to be read back in
+    from the subset cache on disk next time. The searches keep coming back to
+    the same subsets, so we keep hold of the ones we've used recently. Once
+    we pass the limit, the one we used longest ago is let go.
+    """
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self.subsets = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def use(self, cacheid, sub, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        # Move it to the end, where the most recent ones are
+        self.subsets.pop(cacheid, None)
+        if self.size < 1:
+            return
+        self.subsets[cacheid] = sub
+        while len(self.subsets) > self.size:
+            self.subsets.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.subsets.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def report(self):
+        looked_up = self.hits + self.misses
+        if not looked_up:
+            return
+        log.info("Subsets found in memory %d times out of %d (%.1f%%), "
+                 "%d let go from the %d most recently used",
+                 self.hits, looked_up, 100.0 * self.hits / looked_up,
+                 self.evictions, self.size)
+
+
+recent_subsets = RecentSubsets()
+
+
+def get_min_info_score(meth, K, n):
+    """The lowest score a model with K parameters can get on n sites"""
+    if meth == "aic":
+        return 2.0 * K
+    if meth == "bic":
+        return K * logarithm(n)
+    if meth == "aicc":
+        # Same catch as in Subset.add_result
+        if n < (K + 2):
+            n = K + 2
+        return (2.0 * K) * (n / (n - K - 1.0))
+
+    log.error("Model selection option %s not recognised, please check" % meth)
+    raise SubsetError
+
+
+def get_mask(parts):
+    """The partitions as an integer, with a bit set for each of them"""
+    mask = 0
+    for p in parts:
+        if p.partition_set is None:
+            log.error("You cannot add a Partition to a Subset until "
+                      "the Partition belongs to a PartitionSet")
+            raise SubsetError
+
+        if mask & p.mask:
+            log.error("%s is duplicated in a Subset", p)
+            raise SubsetError
+
+        mask |= p.mask
+    return mask
+
+
+def get_cache_id(parts):
+    # The bits are only unique within a PartitionSet, and we sometimes have
+    # more than one of those (e.g. in the tests)
+    if not parts:
+        return None
+    return parts[0].partition_set, get_mask(parts)
 
 
 class Subset(object):
@@ -54,58 +148,67 @@ class Subset(object):
     # TODO: Move this to the config -- once we have a global one
     _cache = weakref.WeakValueDictionary()
 
+    # Are we only using some of the sites? See SubsetSample
+    sampled = False
+
+    # There can be hundreds of thousands of these, so we don't give them a
+    # __dict__. The __weakref__ is for the _cache.
+    __slots__ = (
+        'status', 'partitions', 'mask', 'columns', 'alignment_path',
+        'results', 'pruned_models', 'screen_results',
+        'models_to_screen', 'models_not_screened', 'models_to_process',
+        'models_not_done', 'selected_with', 'best_info_score', 'best_model',
+        'best_params', 'best_lnl', 'best_site_rate', 'best_alpha',
+        'best_freqs', 'best_modelparams', 'changed', '_full_name', '_name',
+        '__weakref__')
+
     def __new__(cls, *parts):
         """Return the SAME subset if the partitions are identical. This is
         basically a pythonized factory. See here:
         http://codesnipers.com/?q=python-flyweights
         """
 
-        cacheid = frozenset(parts)
-        obj = Subset._cache.get(cacheid, None)
-        # TODO Flush cache? USE MRU? functools.lrucache
-        if not obj:
+        cacheid = get_cache_id(parts)
+        obj = cls._cache.get(cacheid, None)
+        hit = obj is not None
+        if not hit:
             obj = object.__new__(cls)
-            Subset._cache[cacheid] = obj
-            obj.init(cacheid, *parts)
+            cls._cache[cacheid] = obj
+            obj.init(*parts)
+        recent_subsets.use(cacheid, obj, hit)
 
         # obj = object.__new__(cls)
         # cacheid = frozenset(parts)
         # obj.init(cacheid, *parts)
         return obj
 
-    def init(self, cacheid, *parts):
-        # Error checking....
+    def init(self, *parts):
         self.status = FRESH
 
-        tempparts = set()
-        for p in parts:
-            if p.partition_set is None:
-                log.error("You cannot add a Partition to a Subset until "
-                          "the Partition belongs to a PartitionSet")
-                raise SubsetError
-
-            if p in tempparts:
-                log.error("%s is duplicated in a Subset", p)
-                raise SubsetError
-
-            tempparts.add(p)
-
-        self.partitions = cacheid
+        # The partitions, as a set and as the bits of an integer, which is
+        # much quicker for comparing subsets
+        self.partitions = frozenset(parts)
+        self.mask = get_mask(parts)
 
-        # a list of columns in the subset
-        self.columns = []
-        self.columnset = set()
-        for p in parts:
-            self.columns += p.columns
-            self.columnset |= p.columnset
-        self.columns.sort()
+        # The columns in the subset. Partitions never overlap, so this is
+        # just their runs put together
+        self.columns = ColumnSet().union(*[p.columns for p in parts])
 
         self.results = {}
+        # Models we didn't run, keyed by model, with the model_selection
+        # they were pruned under
+        self.pruned_models = {}
+        # Low precision results, used for screening the models
+        self.screen_results = {}
+        self.models_to_screen = []
         self.best_info_score = None  # e.g. AIC, BIC, AICc
         self.best_model = None
         self.best_params = None
         self.best_lnl = None
+        self.selected_with = None
         self.alignment_path = None
+        # Whether we have results that aren't in the store yet
+        self.changed = False
         log.debug("Created %s", self)
 
     def __str__(self):
@@ -138,12 +241,12 @@ class Subset(object):
     def __iter__(self):
         return iter(self.partitions)
 
-    def add_result(self, cfg, model, result):
+    def add_result(self, cfg, model, result, screen=False):
         result.model = model
         result.params = cfg.processor.models.get_num_params(model)
 
         K = float(result.params)
-        n = float(len(self.columnset))
+        n = float(len(self.columns))
         lnL = float(result.lnl)
         #here we put in a catch for small subsets, where n<K+2
         #if this happens, the AICc actually starts rewarding very small datasets, which is wrong
@@ -151,7 +254,7 @@ class Subset(object):
         result.aic = (-2.0 * lnL) + (2.0 * K)
         result.bic = (-2.0 * lnL) + (K * logarithm(n))
 
-        if n < (K + 2):
+        if n < (K + 2) and not screen:
             log.warning("The subset containing the following data_blocks: %s, has a very small"
                         " number of sites (%d) compared to the number of parameters"
                         " in the model being estimated (the %s model which has %d parameters)."
@@ -159,6 +262,7 @@ class Subset(object):
                         " if you are using the AICc for your analyses."
                         " The model selection results for this subset are in the following file:"
                         " /analysis/subsets/%s.txt\n" % (self, n, model, K, self.name))
+        if n < (K + 2):
             n = K + 2
 
         result.aicc = (-2.0 * lnL) + ((2.0 * K) * (n / (n - K - 1.0)))
@@ -168,6 +272,11 @@ class Subset(object):
 
         log.debug("Adding model to subset. Model: %s, params %d, site_rate %f" % (model, K, result.site_rate))
 
+        self.changed = True
+        if screen:
+            self.screen_results[model] = result
+            return
+
         if model in self.results:
             log.error("Can't add model result %s, it already exists in %s",
                       model, self)
@@ -179,8 +288,11 @@ class Subset(object):
         # around
         self.best_info_score = None  # Reset this before model selection
         meth = cfg.model_selection.lower()
+        self.selected_with = (meth, frozenset(cfg.models))
 
         for model in cfg.models:
+            if model in self.pruned_models:
+                continue
             result = self.results[model]
             try:
                 info_score = getattr(result, meth)
@@ -209,16 +321,10 @@ class Subset(object):
         param_values["rate"] = self.best_site_rate
         param_values["alpha"] = self.best_alpha
 
-        #not sure if this sorting is necessary, but it's here in case it's needed
-        #to make sure that freqs and model parameters are always in the same order
-        #can't hurt... (i hope).
-        keys_f = self.best_freqs.keys()
-        keys_f.sort()
-        param_values["freqs"] = [self.best_freqs[key] for key in keys_f]
-
-        keys_m = self.best_modelparams.keys()
-        keys_m.sort()
-        param_values["model"] = [self.best_modelparams[key] for key in keys_m]
+        # The results keep these in a fixed order (sorted by letter), so
+        # they line up between subsets
+        param_values["freqs"] = list(self.best_freqs)
+        param_values["model"] = list(self.best_modelparams)
 
         return param_values
 
@@ -228,60 +334,230 @@ class Subset(object):
 
         # We might already have done everything
         if self.status == DONE:
+            # But maybe with different model selection settings
+            if not self.is_selected(cfg):
+                self.load_results(cfg)
+                self.model_selection(cfg)
+                self.slim()
             return True
 
-        # Do all the final cleanup
-        cfg.reporter.write_subset_summary(self)
-        self.save_results(cfg)
+        # Do all the final cleanup. Results that came from the store are
+        # already saved, and summarised
+        if self.changed:
+            cfg.reporter.write_subset_summary(self)
+            self.save_results(cfg)
+            self.changed = False
+            if not cfg.save_phylofiles:
+                remove_runID_files(self.alignment_path)
         self.model_selection(cfg)
-        if not cfg.save_phylofiles:
-            remove_runID_files(self.alignment_path)
 
         self.models_to_process = []
+        self.models_to_screen = []
         self.status = DONE
-        cfg.progress.subset_done(self)
+        if not self.sampled:
+            cfg.progress.subset_done(self)
+        self.slim()
         return True
 
-    def prepare(self, cfg, alignment):
+    def is_selected(self, cfg):
+        """Whether the best model was chosen with these settings"""
+        return self.selected_with == (cfg.model_selection.lower(),
+                                      frozenset(cfg.models))
+
+    def slim(self):
+        """Let go of the results, once we've chosen the best model
+
+        The searches only need the best model and its scores, and the results
+        are all in the subset cache on disk, so we read them back in if we
+        ever need to choose again. Otherwise long searches would hold on to a
+        result for every model of every subset they have looked at.
+        """
+        self.results = None
+        self.screen_results = None
+        self.pruned_models = None
+
+    @property
+    def slimmed(self):
+        return self.results is None
+
+    def prepare(self, cfg, writer):
         """Get everything ready for running the analysis
         """
         # cfg.progress.update_subsets(self)
         cfg.progress.subset_begin(self)
 
+        # A finished subset has nothing else to do, unless the models or the
+        # model selection have changed
+        if self.slimmed and self.is_selected(cfg):
+            return
+
         # Load the cached results
         self.load_results(cfg)
 
         # First, see if we've already got the results loaded. Then we can
         # shortcut all the other checks
-        models_done = set(self.results.keys())
+        self.check_pruned_models(cfg)
+        models_done = set(self.results.keys()) | set(self.pruned_models.keys())
         self.models_not_done = cfg.models - models_done
+        self.prune_models(cfg)
         if self.finalise(cfg):
             return
 
+        # We might have finished with a different set of models before
+        if self.status == DONE:
+            self.status = FRESH
+
         # Make an Alignment from the source, using this subset
-        self.make_alignment(cfg, alignment)
+        self.make_alignment(cfg, writer)
 
         # Try and read in some previous analyses
         self.parse_results(cfg)
+        self.prune_models(cfg)
         if self.finalise(cfg):
             return
 
+        self.models_to_screen = []
+        if cfg.screen_margin is not None:
+            # Every model has to be screened before we know which ones are
+            # worth running properly
+            self.models_not_screened = set(
+                [m for m in self.models_not_done
+                 if m not in self.screen_results])
+            for m in list(self.models_not_screened):
+                self.parse_model_result(cfg, m, screen=True)
+
+            if self.models_not_screened:
+                self.models_to_screen = list(self.models_not_screened)
+                self.models_to_screen.sort(
+                    key=cfg.processor.models.get_model_difficulty,
+                    reverse=True)
+                self.models_to_process = []
+                self.status = PREPARED
+                return
+
+            self.prune_models(cfg)
+            if self.finalise(cfg):
+                return
+
         self.models_to_process = list(self.models_not_done)
-        # Now order them by difficulty
-        self.models_to_process.sort(
-            key=cfg.processor.models.get_model_difficulty,
-            reverse=True)
+        if cfg.prune_models:
+            # Run the models with fewest parameters first, their scores are
+            # what allows us to prune the bigger ones
+            self.models_to_process.sort(
+                key=cfg.processor.models.get_num_params)
+        else:
+            # Now order them by difficulty
+            self.models_to_process.sort(
+                key=cfg.processor.models.get_model_difficulty,
+                reverse=True)
 
         self.status = PREPARED
 
+    def get_prune_reason(self, cfg, model):
+        """Return why a model is not worth running for this subset, or None
+
+        The log likelihood can never be above zero, so the information score
+        of a model can never be below its penalty term. If some model we've
+        already got is better than that, there's no point running this one.
+        When screening, we also drop models whose low precision score is too
+        far from the best one.
+        """
+        meth = cfg.model_selection.lower()
+
+        if cfg.prune_models:
+            reason = self.get_bound_reason(cfg, model, meth)
+            if reason is not None:
+                return reason
+
+        if cfg.screen_margin is not None and model in self.screen_results:
+            return self.get_screen_reason(cfg, model, meth)
+
+        return None
+
+    def get_screen_reason(self, cfg, model, meth):
+        # Low precision scores are only comparable with each other, so the
+        # margin is from the best screened score, never a full precision
+        # one. The best can only get lower as we go, so it is safe to use
+        # whatever we have so far
+        best_score = None
+        for other in cfg.models:
+            if other not in self.screen_results:
+                continue
+            score = getattr(self.screen_results[other], meth)
+            if best_score is None or score < best_score:
+                best_score = score
+
+        score = getattr(self.screen_results[model], meth)
+        if score > best_score + cfg.screen_margin:
+            return "screened %s of %.3f is more than %.2f from the best" % (
+                meth, score, cfg.screen_margin)
+
+        return None
+
+    def get_bound_reason(self, cfg, model, meth):
+        K = float(cfg.processor.models.get_num_params(model))
+        n = float(len(self.columns))
+
+        if meth == "aicc" and n < (K + 2):
+            # Only if there's some model that does fit, otherwise we'd have
+            # nothing left to choose from
+            min_K = min(cfg.processor.models.get_num_params(m)
+                        for m in cfg.models)
+            if n >= (min_K + 2):
+                return "too few sites for the AICc (%d sites, %d parameters)" \
+                    % (n, K)
+
+        best_score = None
+        for other in cfg.models:
+            if other in self.results:
+                score = getattr(self.results[other], meth)
+                if best_score is None or score < best_score:
+                    best_score = score
+        if best_score is None:
+            return None
+
+        if get_min_info_score(meth, K, n) > best_score:
+            return "cannot beat the %s of %.3f" % (meth, best_score)
+
+        return None
+
+    def prune_model(self, cfg, model):
+        """Record the model as pruned, if it isn't worth running"""
+        reason = self.get_prune_reason(cfg, model)
+        if reason is None:
+            return False
+
+        log.debug("Pruning model %s from subset %s: %s", model, self, reason)
+        self.pruned_models[model] = cfg.model_selection.lower()
+        self.models_not_done.discard(model)
+        self.changed = True
+        return True
+
+    def prune_models(self, cfg):
+        for m in list(self.models_not_done):
+            self.prune_model(cfg, m)
+
+    def check_pruned_models(self, cfg):
+        """Forget about previously pruned models that we might now need
+
+        We might have changed the model_selection, or the models, or turned
+        pruning or screening off since the subset was cached
+        """
+        meth = cfg.model_selection.lower()
+        for model, pruned_under in self.pruned_models.items():
+            if pruned_under != meth or \
+                    self.get_prune_reason(cfg, model) is None:
+                del self.pruned_models[model]
+                self.changed = True
+
     def parse_results(self, cfg):
         """Read in the results and parse them"""
         for m in list(self.models_not_done):
             self.parse_model_result(cfg, m)
 
-    def parse_model_result(self, cfg, model):
+    def parse_model_result(self, cfg, model, screen=False):
         pth, tree_path = cfg.processor.make_output_path(
-            self.alignment_path, model)
+            self.alignment_path, model, screen)
 
         if not os.path.exists(pth):
             # If it ain't there, we can't do it
@@ -290,14 +566,17 @@ class Subset(object):
         output = open(pth, 'rb').read()
         try:
             result = cfg.processor.parse(output, cfg.datatype)
-            self.add_result(cfg, model, result)
+            self.add_result(cfg, model, result, screen)
             # Remove the current model from remaining ones
-            self.models_not_done.remove(model)
+            if screen:
+                self.models_not_screened.remove(model)
+            else:
+                self.models_not_done.remove(model)
 
             # Just used for below
             if not cfg.save_phylofiles:
                 # We remove all files that have the specified RUN ID
-                cfg.processor.remove_files(self.alignment_path, model)
+                cfg.processor.remove_files(self.alignment_path, model, screen)
 
         except cfg.processor.PhylogenyProgramError:
             # If we're loading old files, this is fine
@@ -305,7 +584,7 @@ class Subset(object):
                 log.warning("Failed loading parse output from %s."
                             "Output maybe corrupted. I'll run it again.",
                             pth)
-                cfg.processor.remove_files(self.alignment_path, model)
+                cfg.processor.remove_files(self.alignment_path, model, screen)
             else:
                 # But if we're prepared, then we've just run this. And we're
                 # screwed
@@ -314,59 +593,154 @@ class Subset(object):
                     ", ".join(list(self.models_not_done)))
                 raise
 
-    def make_alignment(self, cfg, alignment):
+    def get_cache_name(self, cfg):
+        """The name we store the results under
+
+        This is a digest of the sites in the subset, and of the settings the
+        results depend on, so we never use stored results that don't belong
+        to this analysis, and never have to throw away ones that do.
+        """
+        digests = sorted([p.digest for p in self.partitions])
+        return md5(cfg.cache_digest + ''.join(digests)).hexdigest()
+
+    def make_alignment(self, cfg, writer):
         # Make an Alignment from the source, using this subset
-        sub_alignment = SubsetAlignment(alignment, self)
-        sub_path = os.path.join(cfg.phylofiles_path, self.name + '.phy')
+        sub_path = os.path.join(
+            cfg.phylofiles_path, self.get_cache_name(cfg) + '.phy')
         # Add it into the sub, so we keep it around
         self.alignment_path = sub_path
 
-        # Maybe it is there already?
+        # Maybe it is there already? It is named after what is in it, so
+        # it will be the same
         if os.path.exists(sub_path):
             log.debug("Found existing alignment file %s", sub_path)
-            old_align = Alignment()
-            old_align.read(sub_path)
-
-            # It had better be the same!
-            if not old_align.same_as(sub_alignment):
-                log.error(
-                    "It looks like you have changed one or more of the "
-                    "data_blocks in the configuration file, "
-                    "so the new subset alignments "
-                    "don't match the ones stored for this analysis. "
-                    "You'll need to run the program with --force-restart")
-                raise SubsetError
         else:
-            # We need to write it
-            sub_alignment.write(sub_path)
+            # We need to write it. This may happen in another process, so
+            # it is only certain to be there once the writer has finished
+            writer.write_subset(self, sub_path)
 
     def get_subset_cache_path(self, cfg):
+        """Where earlier versions kept the results, before the store"""
+        return os.path.join(
+            cfg.subsets_path, self.get_cache_name(cfg) + '.bin')
+
+    def get_old_cache_path(self, cfg):
+        """Where the oldest versions kept the results, named after just the
+        data blocks"""
         return os.path.join(cfg.subsets_path, self.name + '.bin')
 
+    def needs_results(self, cfg):
+        """Whether prepare will have to read in the stored results"""
+        if self.slimmed:
+            return not self.is_selected(cfg)
+        return not self.results
+
     def load_results(self, cfg):
         # We might have already saved a bunch of results, try there first
         if not self.results:
-            log.debug("Reading in cached data from the subsets file")
-            self.read_cache(self.get_subset_cache_path(cfg))
+            log.debug("Reading in cached data from the results store")
+            fields = cfg.result_store.load(self.get_cache_name(cfg))
+            if fields is not None:
+                self.set_cache_fields(fields)
+            elif cfg.result_store.old_pickles:
+                paths = [self.get_subset_cache_path(cfg)]
+                if cfg.result_store.old_names:
+                    paths.append(self.get_old_cache_path(cfg))
+                for pth in paths:
+                    if self.read_cache(pth):
+                        # Keep them in the store from now on
+                        self.save_results(cfg)
+                        break
+            if self.slimmed:
+                log.error("The results for subset %s have gone from the "
+                          "subsets folder, please restart the analysis",
+                          self)
+                raise SubsetError
 
     def save_results(self, cfg):
-        self.write_cache(self.get_subset_cache_path(cfg))
+        fields = dict([(x, getattr(self, x)) for x in Subset._cache_fields])
+        cfg.result_store.save(self.get_cache_name(cfg), fields)
 
     # These are the fields that get stored for quick loading
-    _cache_fields = "alignment_path results".split()
+    _cache_fields = \
+        "alignment_path results pruned_models screen_results".split()
 
-    def write_cache(self, path):
-        """Write out the results we've collected to a binary file"""
-        f = open(path, 'wb')
-        store = dict([(x, getattr(self, x)) for x in Subset._cache_fields])
-        pickle.dump(store, f, -1)
-        f.close()
+    def set_cache_fields(self, fields):
+        for k, v in fields.items():
+            setattr(self, k, v)
 
     def read_cache(self, path):
         if not os.path.exists(path):
             return False
 
         log.debug("Reading binary cached results for %s", path)
-        f = open(path, 'rb')
-        self.__dict__.update(pickle.load(f))
-        f.close()
+        fields = store.read_pickle(path)
+        # The oldest files don't have all of these
+        fields.setdefault('pruned_models', {})
+        fields.setdefault('screen_results', {})
+        self.set_cache_fields(fields)
+        return True
+
+
+# We don't sample fewer sites than this from any one partition
+MIN_SAMPLE_SITES = 10
+
+
+def get_sample_columns(partition, percent):
+    """A fixed random sample of the columns of a partition
+
+    The random seed comes from the partition name, so we get the same sample
+    every time, and every subset containing the partition uses it
+    """
+    columns = partition.columns
+    size = int(ceil(len(columns) * percent * 0.01))
+    size = max(size, MIN_SAMPLE_SITES)
+    if size >= len(columns):
+        return columns
+
+    seed = int(md5(partition.name).hexdigest(), 16)
+    return ColumnSet.from_columns(
+        random.Random(seed).sample(list(columns), size))
+
+
+class SubsetSample(Subset):
+    """A Subset that only uses a sample of the sites in each Partition
+
+    The sample for a merged subset is just the samples of its partitions put
+    together, so the scores of the samples can be compared in the same way as
+    the scores of the full subsets.
+    """
+    _cache = weakref.WeakValueDictionary()
+
+    sampled = True
+
+    __slots__ = ('percent',)
+
+    def __new__(cls, percent, *parts):
+        cacheid = (percent, get_cache_id(parts))
+        obj = cls._cache.get(cacheid, None)
+        hit = obj is not None
+        if not hit:
+            obj = object.__new__(cls)
+            cls._cache[cacheid] = obj
+            obj.init(*parts)
+            obj.set_sample(percent)
+        recent_subsets.use(cacheid, obj, hit)
+        return obj
+
+    def set_sample(self, percent):
+        self.percent = percent
+        self.columns = ColumnSet().union(
+            *[get_sample_columns(p, percent) for p in self.partitions])
+
+    def __str__(self):
+        return "Sample%s" % Subset.__str__(self)
+
+    @property
+    def full_name(self):
+        return "sample%s-%s" % (self.percent, Subset.full_name.fget(self))
+
+    def get_cache_name(self, cfg):
+        # The sample of sites depends on the names of the partitions too
+        return md5(Subset.get_cache_name(self, cfg) +
+                   self.full_name).hexdigest()
@@ -31,6 +31,52 @@ class PhylogenyProgramError(PartitionFinderError):
     pass
 
 
+class Record(object):
+    """A small object with fixed fields, and no __dict__
+
+    We make a lot of these (one per model per subset), so leaving out the
+    __dict__ saves plenty of memory. They pickle as a dict of the fields that
+    are set, which is also how the old dict based versions pickled, so old
+    cached results still load.
+    """
+    __slots__ = ()
+
+    def get_fields(self):
+        fields = []
+        for cls in type(self).__mro__:
+            fields.extend(getattr(cls, '__slots__', ()))
+        return [f for f in fields if f != '__weakref__']
+
+    def __getstate__(self):
+        state = {}
+        for f in self.get_fields():
+            if hasattr(self, f):
+                state[f] = getattr(self, f)
+        return state
+
+    def __setstate__(self, state):
+        # Old pickles can have fields we no longer keep
+        fields = set(self.get_fields())
+        for k, v in state.items():
+            if k in fields:
+                setattr(self, k, v)
+
+
+class ModelResult(Record):
+    """The result of running one model on one subset
+
+    The phylogeny program fills in the likelihood etc., and the subset adds
+    the information scores. Programs that don't report the model parameters
+    leave them empty.
+    """
+    __slots__ = ('lnl', 'tree_size', 'seconds', 'model', 'params',
+                 'aic', 'bic', 'aicc', 'site_rate')
+
+    rates = ()
+    freqs = ()
+    alpha = 0
+
+
 def check_file_exists(pth):
     if not os.path.exists(pth) or not os.path.isfile(pth):
         if pth.count("partition_finder.cfg") > 0:
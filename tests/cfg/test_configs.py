@@ -50,3 +50,57 @@ def test_protein_success(prot_success):
 
 def test_protein_failure(prot_failure):
     do_failure("protein", prot_failure)
+
+
+def test_search_models():
+    c = config.Configuration(search_models="GTR+G, HKY+G")
+    assert c.search_models == ["GTR+G", "HKY+G"]
+    with pytest.raises(config.ConfigurationError):
+        config.Configuration(search_models="GTR+G, NOTAMODEL")
+
+    # Only the models for the datatype we have
+    c = config.Configuration(datatype="protein", search_models="LG+G")
+    assert c.search_models == ["LG+G"]
+    with pytest.raises(config.ConfigurationError):
+        config.Configuration(datatype="DNA", search_models="LG+G")
+    with pytest.raises(config.ConfigurationError):
+        config.Configuration(datatype="protein", search_models="GTR+G")
+
+
+def test_sweep():
+    c = config.Configuration(sweep_model_selection="aic, BIC",
+                             sweep_cluster_weights="1,0,0,0; 1,1,1,1")
+    c.search = "rcluster"
+    sweep = c.get_sweep()
+    assert [name for name, settings in sweep] == [
+        "aic-weights1_0_0_0", "aic-weights1_1_1_1",
+        "bic-weights1_0_0_0", "bic-weights1_1_1_1"]
+    assert sweep[3][1] == {
+        "model_selection": "bic",
+        "cluster_weights": {"rate": 1.0, "freqs": 1.0,
+                            "model": 1.0, "alpha": 1.0}}
+
+    # The weights are only for the clustering searches
+    c.search = "greedy"
+    with pytest.raises(config.ConfigurationError):
+        c.get_sweep()
+
+    with pytest.raises(config.ConfigurationError):
+        config.Configuration(sweep_model_selection="aic, nope")
+    assert config.Configuration().get_sweep() is None
+
+
+def test_start_scheme_search():
+    c = config.Configuration(start_scheme="step_2")
+    for search in ["all", "user"]:
+        c.search = search
+        with pytest.raises(config.ConfigurationError):
+            c.validate()
+
+
+def test_prescreen_numpy_version(monkeypatch):
+    import numpy
+    assert config.Configuration(prescreen=5).prescreen == 5
+    monkeypatch.setattr(numpy, '__version__', '1.12.1')
+    with pytest.raises(config.ConfigurationError):
+        config.Configuration(prescreen=5)